@@ -0,0 +1,42 @@
+class Access:
+    """What one user may do, read from the admin dicts in one go"""
+
+    __slots__ = ("user_id", "owner", "admin", "blocked", "muted", "lover", "dirty")
+
+    def __init__(self, user_id: str, owner=False, admin=False, blocked=False, muted=False, lover=False,
+                 dirty=False):
+        self.user_id = user_id
+        self.owner = owner
+        self.admin = admin
+        self.blocked = blocked
+        self.muted = muted
+        self.lover = lover
+        self.dirty = dirty
+
+
+class AccessTable:
+    """Cache of Access records by user id (always as a string), built by compute(user_id).
+
+    Admin data changes rarely and every change goes through invalidate(), so a record is
+    built once per user and then served by one dict lookup per update until the next change.
+    """
+
+    def __init__(self, compute, max_cached: int = 100000):
+        self.compute = compute
+        self.max_cached = max_cached
+        self._records = {}
+
+    def get(self, user_id) -> Access:
+        user_id = str(user_id)
+        record = self._records.get(user_id)
+        if record is None:
+            if len(self._records) >= self.max_cached:
+                self._records.clear()
+            record = self._records[user_id] = self.compute(user_id)
+        return record
+
+    def invalidate(self):
+        self._records.clear()
+
+    def __len__(self) -> int:
+        return len(self._records)
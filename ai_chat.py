@@ -1,91 +1,227 @@
 import os
 import logging
+import asyncio
+import json
 import random
+import time
 from google import genai
 from google.genai import types
+from history_store import ChatHistories, create_history_store, create_history_budget
+from classifier import CATEGORIES, KeywordClassifier, MessageFlags
+from key_pool import GeminiKeyPool, load_api_keys
+from response_cache import create_response_cache, context_fingerprint
+from token_budget import estimate_tokens, load_context_budgets, PromptTokenStats
+from cpu_pool import create_cpu_pool
+from metrics import GEMINI_SECONDS, GEMINI_REQUESTS, GEMINI_FALLBACKS, GEMINI_EMPTY, CLASSIFIER_HITS
 
 logger = logging.getLogger(__name__)
 
-client = None
-backup_client = None
+# Optional worker processes that classify long messages off the event loop; None when disabled.
+# Created before any client, thread or database connection exists, since it forks its workers now.
+cpu_pool = create_cpu_pool()
 
-def get_client():
-    """Get primary client"""
-    global client
-    if client is None:
-        api_key = os.environ.get("GEMINI_API_KEY")
-        if api_key:
-            try:
-                client = genai.Client(api_key=api_key)
-            except Exception as e:
-                logger.error(f"Failed to initialize primary client: {e}")
-                return None
-    return client
-
-def get_backup_client():
-    """Get backup client for fallback"""
-    global backup_client
-    if backup_client is None:
-        api_key = os.environ.get("GEMINI_API_KEY_BACKUP")
-        if api_key:
-            try:
-                backup_client = genai.Client(api_key=api_key)
-            except Exception as e:
-                logger.error(f"Failed to initialize backup client: {e}")
-                return None
-    return backup_client
+# Upper bound on in-flight Gemini requests so a burst of chats can't open unbounded connections
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "16"))
+gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
 
-def call_gemini_with_fallback(contents, system_instruction, temperature=0.7):
-    """Call Gemini API with automatic fallback to backup key"""
-    try:
-        ai_client = get_client()
-        if not ai_client:
-            logger.error("Primary Gemini client is None - API key missing")
-            ai_client = get_backup_client()
-            if not ai_client:
-                logger.error("Backup Gemini client also failed - NO API KEYS SET")
-                return None
-        
-        response = ai_client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=contents,
-            config=types.GenerateContentConfig(
-                system_instruction=system_instruction,
-                temperature=temperature,
-            )
-        )
-        if response and response.text:
-            return response
-        logger.error("Response from Gemini was empty or None")
+def create_client(api_key: str):
+    return genai.Client(api_key=api_key)
+
+key_pool = GeminiKeyPool(load_api_keys(), create_client)
+
+async def call_gemini_with_fallback(contents, system_instruction, temperature=0.7, persona="other"):
+    """Call Gemini with the healthiest key in the pool, failing over to the next one on errors"""
+    if not len(key_pool):
+        logger.error("NO API KEYS SET - add GEMINI_API_KEY to the environment")
         return None
-    except Exception as e:
-        logger.error(f"Primary API key failed: {e}. Trying backup key...")
-        try:
-            backup = get_backup_client()
-            if not backup:
-                logger.error("No backup API key available")
+    
+    async with gemini_semaphore:
+        tried = []
+        while len(tried) < len(key_pool):
+            key = key_pool.acquire(exclude=tried)
+            if key is None:
+                logger.error("All Gemini API keys are cooling down")
                 return None
-            
-            response = backup.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=contents,
-                config=types.GenerateContentConfig(
-                    system_instruction=system_instruction,
-                    temperature=temperature,
+            if tried:
+                GEMINI_FALLBACKS.labels(persona).inc()
+            tried.append(key)
+            started = time.perf_counter()
+            try:
+                response = await key.client.aio.models.generate_content(
+                    model="gemini-2.5-flash",
+                    contents=contents,
+                    config=types.GenerateContentConfig(
+                        system_instruction=system_instruction,
+                        temperature=temperature,
+                    )
                 )
-            )
+            except Exception as e:
+                GEMINI_SECONDS.labels(persona, key.name).observe(time.perf_counter() - started)
+                GEMINI_REQUESTS.labels(persona, key.name, "error").inc()
+                key_pool.release(key, e)
+                logger.error(f"Gemini key {key.name} failed: {e}")
+                continue
+            GEMINI_SECONDS.labels(persona, key.name).observe(time.perf_counter() - started)
+            key_pool.release(key)
             if response and response.text:
-                logger.info("Backup API key worked!")
+                GEMINI_REQUESTS.labels(persona, key.name, "ok").inc()
                 return response
+            GEMINI_REQUESTS.labels(persona, key.name, "empty").inc()
+            GEMINI_EMPTY.labels(persona).inc()
+            logger.error("Response from Gemini was empty or None")
             return None
-        except Exception as e2:
-            logger.error(f"Backup API key also failed: {e2}")
-            return None
+        logger.error("All Gemini API keys failed")
+        return None
+
+async def stream_gemini_with_fallback(contents, system_instruction, temperature=0.7, on_partial=None, persona="other"):
+    """Stream a reply from Gemini, awaiting on_partial(text_so_far) per chunk; returns the full text or None.
+    
+    Fails over to another key only until the first chunk arrives; after that the partial text is
+    already on screen, so a broken stream just ends the reply early.
+    """
+    if not len(key_pool):
+        logger.error("NO API KEYS SET - add GEMINI_API_KEY to the environment")
+        return None
+    
+    async with gemini_semaphore:
+        tried = []
+        while len(tried) < len(key_pool):
+            key = key_pool.acquire(exclude=tried)
+            if key is None:
+                logger.error("All Gemini API keys are cooling down")
+                return None
+            if tried:
+                GEMINI_FALLBACKS.labels(persona).inc()
+            tried.append(key)
+            text = ""
+            started = time.perf_counter()
+            try:
+                stream = await key.client.aio.models.generate_content_stream(
+                    model="gemini-2.5-flash",
+                    contents=contents,
+                    config=types.GenerateContentConfig(
+                        system_instruction=system_instruction,
+                        temperature=temperature,
+                    )
+                )
+                async for chunk in stream:
+                    if chunk.text:
+                        text += chunk.text
+                        if on_partial:
+                            await on_partial(text)
+            except Exception as e:
+                GEMINI_SECONDS.labels(persona, key.name).observe(time.perf_counter() - started)
+                GEMINI_REQUESTS.labels(persona, key.name, "error").inc()
+                key_pool.release(key, e)
+                logger.error(f"Gemini key {key.name} failed while streaming: {e}")
+                if text:
+                    return text
+                continue
+            GEMINI_SECONDS.labels(persona, key.name).observe(time.perf_counter() - started)
+            key_pool.release(key)
+            GEMINI_REQUESTS.labels(persona, key.name, "ok" if text else "empty").inc()
+            if not text:
+                GEMINI_EMPTY.labels(persona).inc()
+                logger.error("Streamed response from Gemini was empty")
+            return text or None
+        logger.error("All Gemini API keys failed")
+        return None
 
-conversation_history = {}
-group_conversation_history = {}
-dirty_conversation_history = {}
-user_preferences = {}
+async def generate_reply(contents, system_instruction, temperature=0.7, on_partial=None, persona="other"):
+    """Reply text or None; streams through on_partial when one is given"""
+    if on_partial is not None:
+        return await stream_gemini_with_fallback(contents, system_instruction, temperature, on_partial, persona=persona)
+    response = await call_gemini_with_fallback(contents, system_instruction, temperature, persona=persona)
+    if not response or not response.text:
+        return None
+    return response.text
+
+history_store = create_history_store()
+history_budget = create_history_budget(history_store.durable)
+conversation_history = ChatHistories("private", 30, history_store, history_budget)
+group_conversation_history = ChatHistories("group", 50, history_store, history_budget)
+dirty_conversation_history = ChatHistories("dirty", 30, history_store, history_budget)
+user_preferences = ChatHistories("prefs", 10, history_store, history_budget)
+
+CONTEXT_TOKEN_BUDGETS = load_context_budgets()
+prompt_token_stats = PromptTokenStats()
+
+def build_prompt(persona: str, history, system_instruction: str):
+    """Returns (contents, system_instruction): the running summary rides in the system
+    instruction and the newest turns fill whatever is left of the persona's token budget"""
+    budget = CONTEXT_TOKEN_BUDGETS[persona]
+    if history.summary:
+        system_instruction = f"{system_instruction}\n\nEARLIER IN THIS CONVERSATION (summary):\n{history.summary}"
+        budget = max(0, budget - estimate_tokens(history.summary))
+    contents, history_tokens = history.window(budget)
+    prompt_token_stats.record(persona, history_tokens + estimate_tokens(system_instruction))
+    return contents, system_instruction
+
+# Once a history reaches SUMMARY_TRIGGER_TURNS turns (0 disables), the background summarizer
+# folds all but the newest SUMMARY_KEEP_TURNS into the chat's running summary
+SUMMARY_TRIGGER_TURNS = int(os.environ.get("SUMMARY_TRIGGER_TURNS", "24"))
+SUMMARY_KEEP_TURNS = int(os.environ.get("SUMMARY_KEEP_TURNS", "12"))
+
+SUMMARY_INSTRUCTION = """You keep a running summary of a chat between Naina and the people she talks to.
+
+Merge the current summary with the new messages into ONE updated summary:
+- Under 120 words, plain sentences
+- Keep names, facts people shared, preferences, promises, ongoing topics and the mood
+- Drop greetings and small talk that doesn't matter later
+- Output ONLY the summary text"""
+
+async def summarize_conversation(histories, chat_id: str, history) -> bool:
+    folded = list(history.turns)[:len(history) - SUMMARY_KEEP_TURNS]
+    if not folded:
+        return False
+    transcript = "\n".join(turn.text if turn.role == "user" else f"Naina: {turn.text}" for turn in folded)
+    prompt = f"Current summary:\n{history.summary or '(none yet)'}\n\nNew messages:\n{transcript}"
+    contents = [types.Content(role="user", parts=[types.Part(text=prompt)])]
+    response = await call_gemini_with_fallback(contents, SUMMARY_INSTRUCTION, temperature=0.3, persona="summary")
+    if not response or not response.text:
+        return False
+    return histories.fold_into_summary(chat_id, history, folded, response.text.strip())
+
+async def summarize_histories(max_chats: int = 5) -> int:
+    """Background pass: summarize the longest resident histories past the trigger; returns how many were folded"""
+    if not SUMMARY_TRIGGER_TURNS:
+        return 0
+    candidates = []
+    for histories in (conversation_history, group_conversation_history, dirty_conversation_history):
+        for chat_id, history in histories.resident_items():
+            if len(history) >= SUMMARY_TRIGGER_TURNS:
+                candidates.append((len(history), histories, chat_id, history))
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+    folded = 0
+    for _, histories, chat_id, history in candidates[:max_chats]:
+        try:
+            if await summarize_conversation(histories, chat_id, history):
+                folded += 1
+        except Exception as e:
+            logger.error(f"Error summarizing {histories.mode} chat {chat_id}: {e}")
+    return folded
+
+# Opt-in cache for short repeated messages ("hi naina", "good morning"); None when disabled
+response_cache = create_response_cache()
+# How many previous turns feed the cache key; 0 keys on persona + message only
+RESPONSE_CACHE_CONTEXT_TURNS = int(os.environ.get("RESPONSE_CACHE_CONTEXT_TURNS", "0"))
+
+def lookup_cached_reply(persona: str, history, user_message: str):
+    """Returns (cached reply or None, fingerprint to cache under or None if the message isn't cacheable)"""
+    if response_cache is None or not response_cache.eligible(user_message):
+        return None, None
+    fingerprint = ""
+    if RESPONSE_CACHE_CONTEXT_TURNS and history:
+        fingerprint = context_fingerprint(turn.text for turn in history[-RESPONSE_CACHE_CONTEXT_TURNS:])
+    return response_cache.get(persona, user_message, fingerprint), fingerprint
+
+def store_cached_reply(persona: str, fingerprint, user_message: str, user_name: str, reply: str):
+    if fingerprint is None:
+        return
+    # A reply that names the sender would greet the wrong person when replayed
+    if user_name and user_name.lower() in reply.lower():
+        return
+    response_cache.put(persona, user_message, fingerprint, reply)
 
 NAINA_PERSONALITY = """You are Naina, a real 19-year-old Indian girl. You're helpful, respectful, and genuine. NEVER mention being AI/bot.
 
@@ -192,50 +328,93 @@ STICKERS = {
     "angry": []
 }
 
+KEYWORDS_FILE = os.environ.get("KEYWORDS_FILE", "keywords.json")
+
+keyword_classifier = KeywordClassifier({
+    "dirty": DIRTY_KEYWORDS,
+    "abuse": ABUSE_KEYWORDS,
+    "advice": ADVICE_KEYWORDS,
+})
+
+if cpu_pool:
+    cpu_pool.reload(keyword_classifier.categories)
+
+def reload_keywords() -> bool:
+    """Reload keyword lists from KEYWORDS_FILE (if present) and rebuild the classifier"""
+    try:
+        if os.path.exists(KEYWORDS_FILE):
+            with open(KEYWORDS_FILE, 'r') as f:
+                data = json.load(f)
+            DIRTY_KEYWORDS[:] = data.get("dirty", DIRTY_KEYWORDS)
+            ABUSE_KEYWORDS[:] = data.get("abuse", ABUSE_KEYWORDS)
+            ADVICE_KEYWORDS[:] = data.get("advice", ADVICE_KEYWORDS)
+        keyword_classifier.reload({
+            "dirty": DIRTY_KEYWORDS,
+            "abuse": ABUSE_KEYWORDS,
+            "advice": ADVICE_KEYWORDS,
+        })
+        if cpu_pool:
+            cpu_pool.reload(keyword_classifier.categories)
+        return True
+    except Exception as e:
+        logger.error(f"Error reloading keywords: {e}")
+        return False
+
+# classify_mask result -> CLASSIFIER_HITS children of its categories, filled in on first hit
+classifier_hit_counters = {}
+
+def record_classifier_hits(mask: int) -> MessageFlags:
+    """Count the categories in a classify_mask result and return its flags"""
+    if mask:
+        counters = classifier_hit_counters.get(mask)
+        if counters is None:
+            counters = classifier_hit_counters[mask] = [
+                CLASSIFIER_HITS.labels(category) for index, category in enumerate(CATEGORIES) if mask & (1 << index)]
+        for counter in counters:
+            counter.inc()
+    return keyword_classifier.flags_for(mask)
+
+def classify_message(message: str) -> MessageFlags:
+    return record_classifier_hits(keyword_classifier.classify_mask(message))
+
+async def classify_message_async(message: str) -> MessageFlags:
+    """classify_message, sending long messages to the CPU pool when one is configured"""
+    if cpu_pool and cpu_pool.wants(message):
+        try:
+            return record_classifier_hits(await cpu_pool.classify_mask(message))
+        except Exception as e:
+            logger.error(f"CPU pool classification failed, classifying inline: {e}")
+    return classify_message(message)
+
 def is_dirty_message(message: str) -> bool:
-    message_lower = message.lower()
-    for keyword in DIRTY_KEYWORDS:
-        if keyword in message_lower:
-            return True
-    return False
+    return keyword_classifier.classify(message).dirty
 
 def is_abuse_message(message: str) -> bool:
-    message_lower = message.lower()
-    for keyword in ABUSE_KEYWORDS:
-        if keyword in message_lower:
-            return True
-    return False
+    return keyword_classifier.classify(message).abuse
 
 def is_advice_message(message: str) -> bool:
-    message_lower = message.lower()
-    for keyword in ADVICE_KEYWORDS:
-        if keyword in message_lower:
-            return True
-    return False
+    return keyword_classifier.classify(message).advice
 
 def save_user_preference(user_id: str, preference: str):
-    if user_id not in user_preferences:
-        user_preferences[user_id] = []
-    user_preferences[user_id].append(preference)
-    if len(user_preferences[user_id]) > 10:
-        user_preferences[user_id] = user_preferences[user_id][-10:]
+    user_preferences.add_turn(user_id, "user", preference)
 
 def get_user_preferences(user_id: str) -> str:
-    if user_id in user_preferences and user_preferences[user_id]:
-        return "\n\nUser's previous suggestions: " + "; ".join(user_preferences[user_id])
+    preferences = user_preferences.get(user_id)
+    if preferences:
+        return "\n\nUser's previous suggestions: " + "; ".join(turn.text for turn in preferences)
     return ""
 
 def get_sticker_for_mood(mood: str) -> str:
     stickers = STICKERS.get(mood, STICKERS["neutral"])
     return random.choice(stickers) if stickers else None
 
-def get_abuse_response(user_id: str, user_message: str, user_name: str = "User") -> str:
+async def get_abuse_response(user_id: str, user_message: str, user_name: str = "User") -> str:
     try:
         contents = [types.Content(
             role="user",
             parts=[types.Part(text=f"{user_name} said: {user_message}\n\nRespond back with gaalis and a savage comeback.")]
         )]
-        response = call_gemini_with_fallback(contents, ABUSE_RESPONSE_PERSONALITY, temperature=1.0)
+        response = await call_gemini_with_fallback(contents, ABUSE_RESPONSE_PERSONALITY, temperature=1.0, persona="abuse")
         if not response or not response.text:
             return "Chal be, tujhe baat karne ki tameez nahi hai 🙄"
         return response.text
@@ -243,142 +422,90 @@ def get_abuse_response(user_id: str, user_message: str, user_name: str = "User")
         logger.error(f"Error getting abuse response: {e}")
         return "Gaali dena hi aata hai? Chal nikal 🙄"
 
-def get_group_response(chat_id: str, user_name: str, user_message: str) -> str:
+GROUP_BURST_INSTRUCTION = "\n\nSeveral people just messaged at once. Reply with ONE message that responds to all of them together, naming people where it helps."
+
+async def get_group_response(chat_id: str, user_name: str, user_message: str, on_partial=None) -> str:
+    return await get_group_burst_response(chat_id, [(user_name, user_message)], on_partial=on_partial)
+
+async def get_group_burst_response(chat_id: str, messages: list, on_partial=None) -> str:
+    """One reply to a burst of (user_name, message) lines that arrived together"""
     try:
-        if chat_id not in group_conversation_history:
-            group_conversation_history[chat_id] = []
+        cached, fingerprint = None, None
+        if len(messages) == 1:
+            cached, fingerprint = lookup_cached_reply("group", group_conversation_history.get(chat_id), messages[0][1])
+        for user_name, user_message in messages:
+            group_conversation_history.add_turn(chat_id, "user", f"{user_name}: {user_message}")
+        if cached:
+            group_conversation_history.add_turn(chat_id, "model", cached)
+            return cached
+        personality = NAINA_GROUP_PERSONALITY if len(messages) == 1 else NAINA_GROUP_PERSONALITY + GROUP_BURST_INSTRUCTION
+        contents, system_instruction = build_prompt("group", group_conversation_history[chat_id], personality)
         
-        group_conversation_history[chat_id].append({
-            "role": "user",
-            "parts": [{"text": f"{user_name}: {user_message}"}]
-        })
-        
-        if len(group_conversation_history[chat_id]) > 50:
-            group_conversation_history[chat_id] = group_conversation_history[chat_id][-50:]
-        
-        contents = []
-        for msg in group_conversation_history[chat_id]:
-            contents.append(types.Content(
-                role=msg["role"],
-                parts=[types.Part(text=part["text"]) for part in msg["parts"]]
-            ))
-        
-        response = call_gemini_with_fallback(contents, NAINA_GROUP_PERSONALITY, temperature=0.95)
-        if not response or not response.text:
+        ai_response = await generate_reply(contents, system_instruction, temperature=0.95, on_partial=on_partial, persona="group")
+        if not ai_response:
             return "Hmm, kya hua? 😅"
         
-        ai_response = response.text
-        group_conversation_history[chat_id].append({
-            "role": "model",
-            "parts": [{"text": ai_response}]
-        })
+        group_conversation_history.add_turn(chat_id, "model", ai_response)
+        if fingerprint is not None:
+            user_name, user_message = messages[0]
+            store_cached_reply("group", fingerprint, user_message, user_name, ai_response)
         return ai_response
         
     except Exception as e:
         logger.error(f"Error getting group response: {e}")
         return "Oops! Give me a sec- Something went wrong"
 
-def get_ai_response(user_id: str, user_message: str, user_name: str = "Cutie") -> str:
+async def get_ai_response(user_id: str, user_message: str, user_name: str = "Cutie", on_partial=None) -> str:
     try:
-        if user_id not in conversation_history:
-            conversation_history[user_id] = []
-        
         user_prefs = get_user_preferences(user_id)
-        conversation_history[user_id].append({
-            "role": "user",
-            "parts": [{"text": f"{user_name}: {user_message}"}]
-        })
-        
-        if len(conversation_history[user_id]) > 30:
-            conversation_history[user_id] = conversation_history[user_id][-30:]
-        
-        contents = []
-        for msg in conversation_history[user_id]:
-            contents.append(types.Content(
-                role=msg["role"],
-                parts=[types.Part(text=part["text"]) for part in msg["parts"]]
-            ))
+        # Users with saved preferences get a personalised prompt, so their replies aren't shareable
+        cached, fingerprint = (None, None) if user_prefs else lookup_cached_reply(
+            "private", conversation_history.get(user_id), user_message)
+        conversation_history.add_turn(user_id, "user", f"{user_name}: {user_message}")
+        if cached:
+            conversation_history.add_turn(user_id, "model", cached)
+            return cached
         
         personality = NAINA_PERSONALITY + user_prefs
-        response = call_gemini_with_fallback(contents, personality, temperature=0.95)
-        if not response or not response.text:
+        contents, system_instruction = build_prompt("private", conversation_history[user_id], personality)
+        ai_response = await generate_reply(contents, system_instruction, temperature=0.95, on_partial=on_partial, persona="private")
+        if not ai_response:
             return "Hmm, kya hua? 😅"
         
-        ai_response = response.text
-        conversation_history[user_id].append({
-            "role": "model",
-            "parts": [{"text": ai_response}]
-        })
+        conversation_history.add_turn(user_id, "model", ai_response)
+        store_cached_reply("private", fingerprint, user_message, user_name, ai_response)
         return ai_response
         
     except Exception as e:
         logger.error(f"Error getting AI response: {e}")
         return "Oops! Give me a sec~ Something went wrong 😅"
 
-def get_dirty_response(user_id: str, user_message: str, user_name: str = "Baby") -> str:
+async def get_dirty_response(user_id: str, user_message: str, user_name: str = "Baby", on_partial=None) -> str:
     try:
-        if user_id not in dirty_conversation_history:
-            dirty_conversation_history[user_id] = []
-        
-        dirty_conversation_history[user_id].append({
-            "role": "user",
-            "parts": [{"text": f"{user_name}: {user_message}"}]
-        })
-        
-        if len(dirty_conversation_history[user_id]) > 30:
-            dirty_conversation_history[user_id] = dirty_conversation_history[user_id][-30:]
-        
-        contents = []
-        for msg in dirty_conversation_history[user_id]:
-            contents.append(types.Content(
-                role=msg["role"],
-                parts=[types.Part(text=part["text"]) for part in msg["parts"]]
-            ))
+        dirty_conversation_history.add_turn(user_id, "user", f"{user_name}: {user_message}")
+        contents, system_instruction = build_prompt("dirty", dirty_conversation_history[user_id], DIRTY_NAINA)
         
-        response = call_gemini_with_fallback(contents, DIRTY_NAINA, temperature=1.0)
-        if not response or not response.text:
+        ai_response = await generate_reply(contents, system_instruction, temperature=1.0, on_partial=on_partial, persona="dirty")
+        if not ai_response:
             return "Mmm~ 😏"
         
-        ai_response = response.text
-        dirty_conversation_history[user_id].append({
-            "role": "model",
-            "parts": [{"text": ai_response}]
-        })
+        dirty_conversation_history.add_turn(user_id, "model", ai_response)
         return ai_response
         
     except Exception as e:
         logger.error(f"Error getting dirty response: {e}")
         return "Oops! Give me a sec- Something went wrong"
 
-def get_lover_response(user_id: str, user_message: str, user_name: str = "Baby") -> str:
+async def get_lover_response(user_id: str, user_message: str, user_name: str = "Baby", on_partial=None) -> str:
     try:
-        if user_id not in conversation_history:
-            conversation_history[user_id] = []
-        
-        conversation_history[user_id].append({
-            "role": "user",
-            "parts": [{"text": f"{user_name}: {user_message}"}]
-        })
+        conversation_history.add_turn(user_id, "user", f"{user_name}: {user_message}")
+        contents, system_instruction = build_prompt("lover", conversation_history[user_id], LOVER_PERSONALITY)
         
-        if len(conversation_history[user_id]) > 30:
-            conversation_history[user_id] = conversation_history[user_id][-30:]
-        
-        contents = []
-        for msg in conversation_history[user_id]:
-            contents.append(types.Content(
-                role=msg["role"],
-                parts=[types.Part(text=part["text"]) for part in msg["parts"]]
-            ))
-        
-        response = call_gemini_with_fallback(contents, LOVER_PERSONALITY, temperature=0.9)
-        if not response or not response.text:
+        ai_response = await generate_reply(contents, system_instruction, temperature=0.9, on_partial=on_partial, persona="lover")
+        if not ai_response:
             return "I love you~ 💕"
         
-        ai_response = response.text
-        conversation_history[user_id].append({
-            "role": "model",
-            "parts": [{"text": ai_response}]
-        })
+        conversation_history.add_turn(user_id, "model", ai_response)
         return ai_response
         
     except Exception as e:
@@ -469,6 +596,13 @@ def get_random_truth() -> str:
 def get_stats():
     return {
         "total_users": len(conversation_history),
+        "resident_chats": history_budget.resident_chats,
+        "resident_bytes": history_budget.resident_bytes,
+        "evictions": history_budget.evictions + history_budget.expirations,
+        "healthy_keys": f"{key_pool.healthy_count()}/{len(key_pool)}",
+        "response_cache": response_cache.get_stats() if response_cache else "off",
+        "prompt_tokens": prompt_token_stats.get_stats(),
+        "cpu_pool": cpu_pool.get_stats() if cpu_pool else "off",
         "uptime": "Always ready! 💕"
     }
 
@@ -485,18 +619,10 @@ def clear_group_conversation(chat_id: str) -> bool:
     return False
 
 def clear_all_data():
-    global conversation_history, group_conversation_history, dirty_conversation_history
-    conversation_history = {}
-    group_conversation_history = {}
-    dirty_conversation_history = {}
+    conversation_history.clear()
+    group_conversation_history.clear()
+    dirty_conversation_history.clear()
     return True
 
 def add_to_group_history(chat_id: str, user_name: str, message: str):
-    if chat_id not in group_conversation_history:
-        group_conversation_history[chat_id] = []
-    group_conversation_history[chat_id].append({
-        "role": "user",
-        "parts": [{"text": f"{user_name}: {message}"}]
-    })
-    if len(group_conversation_history[chat_id]) > 50:
-        group_conversation_history[chat_id] = group_conversation_history[chat_id][-50:]
+    group_conversation_history.add_turn(chat_id, "user", f"{user_name}: {message}")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: single-pass KeywordClassifier vs the old per-category keyword scans.
+
+First on the shipped keyword lists, then with the lists padded by made-up keywords (as a
+large KEYWORDS_FILE would), since the old scans cost grows with every keyword while the
+single regex pass stays roughly flat. Old and new runs are interleaved and the best of
+each is kept, so a noisy machine skews both alike.
+
+Run from the repo root: python benchmarks/bench_classifier.py [messages]
+"""
+
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_chat import DIRTY_KEYWORDS, ABUSE_KEYWORDS, ADVICE_KEYWORDS, keyword_classifier
+from classifier import KeywordClassifier
+
+PADDING = [0, 100, 400]
+
+HINGLISH_LINES = [
+    "hi naina kaise ho",
+    "good morning sabko 🌞",
+    "kya kar rahi ho aaj kal",
+    "bhai kal ka match dekha kya, kya khela kohli ne",
+    "mujhe lagta hai you should sleep early yaar",
+    "aapke liye ek gaana bhejun?",
+    "class mein aaj bahut bore hua",
+    "pass ho gaya finally exam mein 🥳",
+    "chal be chutiya mat ban",
+    "tu pagal hai kya saala",
+    "kiss me naina 😘",
+    "i think you should try to talk to her",
+    "kal movie chalein? romantic wali",
+    "ye group bahut shant hai aaj",
+    "koi hai kya online? bore ho raha hoon",
+    "maybe you can help me with maths homework",
+    "bhai ye kya bakwas hai, loser ho tum",
+    "haha lol 😂😂",
+    "aaj khana kya banaya ghar pe",
+    "consider this my last warning bewakoof",
+]
+
+
+def old_scan(message, keywords):
+    message_lower = message.lower()
+    for keyword in keywords:
+        if keyword in message_lower:
+            return True
+    return False
+
+
+def old_flags(message, lists):
+    dirty, abuse, advice = lists
+    return old_scan(message, dirty), old_scan(message, abuse), old_scan(message, advice)
+
+
+def made_up_keywords(count, rng):
+    letters = "abcdefghiklmnoprstuy"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(4, 8))) for _ in range(count)]
+
+
+def build_corpus(size):
+    rng = random.Random(42)
+    corpus = []
+    for _ in range(size):
+        # Mix single lines with longer multi-line pastes like real group traffic
+        count = rng.choice([1, 1, 1, 2, 3, 8])
+        corpus.append(" ".join(rng.choice(HINGLISH_LINES) for _ in range(count)))
+    return corpus
+
+
+def best_times(corpus, lists, classifier, repeat=7):
+    """Best old and new time per message, alternating runs"""
+    old = new = float("inf")
+    for _ in range(repeat):
+        old = min(old, timeit.timeit(lambda: [old_flags(message, lists) for message in corpus], number=1))
+        new = min(new, timeit.timeit(lambda: [classifier.classify(message) for message in corpus], number=1))
+    return old / len(corpus), new / len(corpus)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    corpus = build_corpus(size)
+    rng = random.Random(7)
+    print(f"messages: {size}")
+    print(f"{'keywords':>8} | {'old three-scan':>14} | {'single pass':>11} | speedup")
+    for padding in PADDING:
+        lists = (DIRTY_KEYWORDS + made_up_keywords(padding // 2, rng),
+                 ABUSE_KEYWORDS + made_up_keywords(padding // 4, rng),
+                 ADVICE_KEYWORDS + made_up_keywords(padding // 4, rng))
+        classifier = keyword_classifier if not padding else \
+            KeywordClassifier({"dirty": lists[0], "abuse": lists[1], "advice": lists[2]})
+        old, new = best_times(corpus, lists, classifier)
+        print(f"{sum(map(len, lists)):>8} | {old * 1e6:>11.2f} us | {new * 1e6:>8.2f} us | {old / new:.2f}x")
+
+    lists = (DIRTY_KEYWORDS, ABUSE_KEYWORDS, ADVICE_KEYWORDS)
+    changed = [m for m in HINGLISH_LINES
+               if old_flags(m, lists) != (lambda f: (f.dirty, f.abuse, f.advice))(keyword_classifier.classify(m))]
+    if changed:
+        print("\nlines classified differently (substring vs whole-word match):")
+        for line in changed:
+            print(f"  {line!r}: {keyword_classifier.classify(line)}")
+
+
+if __name__ == "__main__":
+    main()
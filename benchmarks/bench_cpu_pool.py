@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Crossover benchmark: classifying inline on the event loop vs batching through CpuPool.
+
+For each message length it fires a burst of concurrent classifications and reports the
+event-loop process's own CPU per message (what the pool is meant to free up) and the
+wall time per message. Where pool CPU drops below inline CPU is the crossover; set
+CPU_POOL_MIN_CHARS around there.
+
+Run from the repo root: python benchmarks/bench_cpu_pool.py [burst] [workers]
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_chat import DIRTY_KEYWORDS, ABUSE_KEYWORDS, ADVICE_KEYWORDS, keyword_classifier
+from cpu_pool import CpuPool
+from bench_classifier import HINGLISH_LINES
+
+LENGTHS = [50, 200, 1000, 4000, 16000, 64000]
+
+
+def build_messages(count, length):
+    rng = random.Random(length)
+    messages = []
+    for _ in range(count):
+        text = ""
+        while len(text) < length:
+            text += rng.choice(HINGLISH_LINES) + " "
+        messages.append(text[:length])
+    return messages
+
+
+async def run_inline(messages):
+    for message in messages:
+        keyword_classifier.classify_mask(message)
+
+
+async def run_pool(pool, messages):
+    await asyncio.gather(*(pool.classify_mask(message) for message in messages))
+
+
+async def measure(run, messages):
+    cpu, wall = time.process_time(), time.perf_counter()
+    await run(messages)
+    return (time.process_time() - cpu) / len(messages), (time.perf_counter() - wall) / len(messages)
+
+
+async def main():
+    burst = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else max(1, (os.cpu_count() or 2) - 1)
+    pool = CpuPool(workers, {"dirty": DIRTY_KEYWORDS, "abuse": ABUSE_KEYWORDS, "advice": ADVICE_KEYWORDS},
+                   min_chars=0, batch_size=64)
+    await run_pool(pool, build_messages(workers * 4, 10))  # fork and warm up the workers
+
+    print(f"burst of {burst} messages, {workers} workers, batches of {pool.batch_size}\n")
+    print(f"{'chars':>7} | {'inline cpu':>11} {'inline wall':>12} | {'pool cpu':>9} {'pool wall':>10} | winner (loop cpu)")
+    crossover = None
+    for length in LENGTHS:
+        messages = build_messages(burst, length)
+        inline_cpu, inline_wall = await measure(run_inline, messages)
+        pool_cpu, pool_wall = await measure(lambda batch: run_pool(pool, batch), messages)
+        winner = "pool" if pool_cpu < inline_cpu else "inline"
+        if winner == "pool" and crossover is None:
+            crossover = length
+        print(f"{length:>7} | {inline_cpu * 1e6:>9.1f}us {inline_wall * 1e6:>10.1f}us | "
+              f"{pool_cpu * 1e6:>7.1f}us {pool_wall * 1e6:>8.1f}us | {winner}")
+    pool.close()
+
+    if crossover is None:
+        print("\npool never beat inline on event-loop CPU at these lengths")
+    else:
+        print(f"\ncrossover: pool wins from ~{crossover} chars per message")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
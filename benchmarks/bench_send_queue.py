@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Send queue check: a busy group's replies, queued through main.reply_in_group, going out
+through a real ExtBot whose HTTP layer is faked.
+
+The group gets a burst of lines that each earn a reply (fake model latency, no network).
+The first sendMessage is answered with a RetryAfter, which pauses the chat. The replies
+that pile up meanwhile should go out as a few merged messages, in the order they were
+produced, instead of one API call each. Prints replies vs API calls and exits non-zero
+if nothing was merged or the order broke.
+
+Run from the repo root: python benchmarks/bench_send_queue.py [replies] [retry_after]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def run(replies: int, retry_after: float):
+    import telegram
+    from telegram.ext import ExtBot
+    from telegram.error import RetryAfter
+    import main
+
+    chat_id = -1005
+    calls = []
+    flood = [True]
+
+    async def fake_do_post(self, endpoint, data, **kwargs):
+        await asyncio.sleep(0.02)
+        if endpoint == "sendMessage" and flood[0]:
+            flood[0] = False
+            raise RetryAfter(retry_after)
+        calls.append((time.perf_counter(), endpoint, dict(data)))
+        return {"message_id": len(calls), "date": 0, "chat": {"id": data["chat_id"], "type": "supergroup"},
+                "text": data.get("text", "")}
+
+    async def fake_burst_response(chat_id_str, lines):
+        await asyncio.sleep(0.05)
+        return f"reply {lines[0][1]}"
+
+    telegram.Bot._do_post = fake_do_post
+    main.get_group_burst_response = fake_burst_response
+    bot = ExtBot("123:abc", rate_limiter=main.send_queue)
+    tasks = set()
+
+    def create_task(coroutine, **kwargs):
+        task = asyncio.ensure_future(coroutine)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return task
+
+    context = SimpleNamespace(bot=bot, application=SimpleNamespace(create_task=create_task))
+    await main.send_queue.initialize()
+    main.scheduler.start()
+
+    started = time.perf_counter()
+    for index in range(replies):
+        main.scheduler.submit(str(chat_id), lambda index=index: main.reply_in_group(
+            context, chat_id, [("User", f"line {index}")]))
+    while True:
+        await asyncio.sleep(0.05)
+        queue = main.scheduler.get_metrics()
+        if not queue["queue_depth"] and not queue["running"] and not main.send_queue.depth and not tasks:
+            break
+    elapsed = time.perf_counter() - started
+    await main.scheduler.stop()
+    await main.send_queue.shutdown()
+
+    texts = [data["text"] for _, endpoint, data in calls if endpoint == "sendMessage"]
+    delivered = [line for text in texts for line in text.split("\n\n")]
+    expected = [f"reply line {index}" for index in range(replies)]
+    print(f"{replies} replies, RetryAfter {retry_after:g}s on the first send")
+    print(f"api calls:   {len(texts)} sendMessage in {elapsed:.1f}s")
+    print(f"per call:    {[text.count(chr(10) * 2) + 1 for text in texts]} replies")
+    print(f"send queue:  {main.send_queue.get_stats()}")
+    in_order = delivered == expected
+    print(f"in order:    {in_order}")
+    return in_order and len(texts) < replies
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    pause = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    os.environ.setdefault("HISTORY_STORE", "memory")
+    os.environ.pop("WEBHOOK_URL", None)
+    os.environ.pop("METRICS_PORT", None)
+    os.environ["STREAM_REPLIES"] = "0"
+    os.chdir(tempfile.mkdtemp(prefix="naina-send-"))
+    sys.exit(0 if asyncio.run(run(count, pause)) else 1)
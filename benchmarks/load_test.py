@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Offline load test: replays synthetic private and group traffic through main.handle_message
+and a few command handlers, with fake Telegram objects and a fake Gemini client in place
+of the network.
+
+Reports end-to-end reply latency (message in -> reply sent) at p50/p95/p99, time spent in
+handle_message itself, throughput, fake-Gemini outcomes and memory. Nothing touches the
+network, and all files are written to a temporary directory.
+
+Run from the repo root:
+    python benchmarks/load_test.py --rate 50 --duration 20 --latency-ms 800 --error-rate 0.02 --rate-limit 0.01
+"""
+
+import os
+import sys
+import time
+import math
+import random
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import contextvars
+from types import SimpleNamespace
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+ARRIVAL = contextvars.ContextVar("arrival", default=None)
+SENT = contextvars.ContextVar("sent", default=None)
+
+PRIVATE_LINES = [
+    "hi naina kaise ho",
+    "aaj ka din bahut bura tha yaar",
+    "kya kar rahi ho?",
+    "mujhe ek achhi movie batao",
+    "good night naina",
+    "tum kahan se ho",
+    "i think you should talk more politely",
+    "kal exam hai, tension ho rahi hai",
+]
+GROUP_CHATTER = ["lol", "haha 😂", "sahi hai bhai", "ok", "gm sabko", "kal match dekha", "😂😂😂", "bas aise hi"]
+GROUP_ADDRESSED = ["naina tum kya soch rahi ho", "naina ek joke sunao", "kya lagta hai sabko, kaun jeetega?",
+                   "koi batao kal chutti hai kya?", "naina good morning!"]
+# command -> callback name in main
+COMMANDS = {
+    "joke": "tell_joke", "quote": "send_quote", "tip": "daily_tip", "compliment": "compliment_command",
+    "fortune": "fortune_command", "dare": "dare_command", "truth": "truth_command", "flip": "flip_command",
+    "dice": "dice_command", "help": "help_command", "status": "status",
+}
+
+
+class FakeApiError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FakeModels:
+    def __init__(self, stats, args, rng):
+        self.stats = stats
+        self.args = args
+        self.rng = rng
+
+    async def _respond(self):
+        self.stats["calls"] += 1
+        median = self.args.latency_ms / 1000
+        await asyncio.sleep(self.rng.lognormvariate(math.log(median), 0.4) if median > 0 else 0)
+        roll = self.rng.random()
+        if roll < self.args.rate_limit:
+            self.stats["rate_limited"] += 1
+            raise FakeApiError(429, "RESOURCE_EXHAUSTED")
+        if roll < self.args.rate_limit + self.args.error_rate:
+            self.stats["errors"] += 1
+            raise FakeApiError(500, "INTERNAL")
+        return "Haan ji, bilkul! Aap bahut achhe ho 😊 " * self.rng.randint(1, 4)
+
+    async def generate_content(self, model, contents, config=None):
+        return SimpleNamespace(text=await self._respond())
+
+    async def generate_content_stream(self, model, contents, config=None):
+        text = await self._respond()
+
+        async def chunks():
+            for start in range(0, len(text), 40):
+                await asyncio.sleep(0.01)
+                yield SimpleNamespace(text=text[start:start + 40])
+
+        return chunks()
+
+
+class FakeMessage:
+    def __init__(self, bot, chat_id, text=None, reply_to_message=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.text = text
+        self.reply_to_message = reply_to_message
+
+    async def reply_text(self, text, **kwargs):
+        return await self.bot.send_message(chat_id=self.chat_id, text=text)
+
+    async def edit_text(self, text, **kwargs):
+        self.bot.edits += 1
+        return self
+
+
+class FakeBot:
+    id = 1
+    username = "naina_bot"
+
+    def __init__(self, send_latency: float, send_queue=None):
+        self.send_latency = send_latency
+        self.send_queue = send_queue
+        self.sent = 0
+        self.edits = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        data = {"chat_id": chat_id, "text": text}
+        if self.send_queue is None:
+            message = await self._post(data)
+        else:
+            # The same path ExtBot takes, so replies are paced and merged as in production
+            message = await self.send_queue.process_request(self._post, (data,), {}, "sendMessage", data, None)
+        sent = SENT.get()
+        if sent is not None:
+            sent.append(time.perf_counter())
+        return message
+
+    async def _post(self, data):
+        await asyncio.sleep(self.send_latency)
+        self.sent += 1
+        return FakeMessage(self, data["chat_id"], data["text"])
+
+    async def send_sticker(self, chat_id, sticker, **kwargs):
+        return await self.send_message(chat_id, "<sticker>")
+
+
+def make_update(bot, user_id, chat_id, chat_type, text):
+    user = SimpleNamespace(id=user_id, username=f"user{user_id}", first_name=f"User{user_id}")
+    chat = SimpleNamespace(id=chat_id, type=chat_type)
+    return SimpleNamespace(effective_user=user, effective_chat=chat, message=FakeMessage(bot, chat_id, text))
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rate", type=float, default=50, help="messages per second")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of traffic")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--group-share", type=float, default=0.6, help="fraction of traffic in groups")
+    parser.add_argument("--command-share", type=float, default=0.05, help="fraction of private traffic that is commands")
+    parser.add_argument("--latency-ms", type=float, default=800, help="median fake Gemini latency")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="fraction of Gemini calls failing with 500")
+    parser.add_argument("--rate-limit", type=float, default=0.01, help="fraction of Gemini calls failing with 429")
+    parser.add_argument("--keys", type=int, default=2, help="fake Gemini keys in the pool")
+    parser.add_argument("--send-latency-ms", type=float, default=30, help="fake Bot API latency")
+    parser.add_argument("--stream", action="store_true", help="run with STREAM_REPLIES=1")
+    parser.add_argument("--no-send-queue", action="store_true", help="send replies without per-chat/global pacing")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--quiet", action="store_true", help="hide warnings from injected failures")
+    return parser.parse_args()
+
+
+async def run(args):
+    import main
+    import ai_chat
+    from key_pool import GeminiKeyPool
+
+    # Injected 429s and 500s would otherwise log a line each
+    logging.getLogger().setLevel(logging.ERROR if args.quiet else logging.WARNING)
+    rng = random.Random(args.seed)
+    gemini_stats = {"calls": 0, "errors": 0, "rate_limited": 0}
+    models = FakeModels(gemini_stats, args, rng)
+    ai_chat.key_pool = GeminiKeyPool([(f"fake{index}", f"key{index}") for index in range(args.keys)],
+                                     lambda api_key: SimpleNamespace(aio=SimpleNamespace(models=models)))
+    bot = FakeBot(args.send_latency_ms / 1000, None if args.no_send_queue else main.send_queue)
+    await main.send_queue.initialize()
+    admin_id = 1000
+    main.admin_ids.add(str(admin_id))
+
+    reply_latencies = []
+    # (arrival, send times) per job; replies are queued and may go out after the job returns
+    job_sends = []
+    handle_latencies = []
+    original_submit = main.scheduler.submit
+
+    def timed_submit(chat_id, job):
+        arrival = ARRIVAL.get()
+
+        async def timed_job():
+            sent = []
+            SENT.set(sent)
+            if arrival is not None:
+                job_sends.append((arrival, sent))
+            try:
+                await job()
+            finally:
+                SENT.set(None)
+
+        return original_submit(chat_id, timed_job)
+
+    main.scheduler.submit = timed_submit
+
+    # Stands in for Application.create_task, which queue_reply hands its sends to
+    reply_tasks = set()
+
+    def create_task(coroutine, **kwargs):
+        task = asyncio.ensure_future(coroutine)
+        reply_tasks.add(task)
+        task.add_done_callback(reply_tasks.discard)
+        return task
+
+    application = SimpleNamespace(create_task=create_task)
+    main.scheduler.start()
+
+    async def one_message():
+        if rng.random() < args.group_share:
+            group_id = -1000 - rng.randrange(args.groups)
+            text = rng.choice(GROUP_ADDRESSED if rng.random() < 0.25 else GROUP_CHATTER)
+            update = make_update(bot, 2000 + rng.randrange(args.users), group_id, "supergroup", text)
+            handler = main.handle_message
+        else:
+            user_id = 2000 + rng.randrange(args.users)
+            if rng.random() < args.command_share:
+                command = rng.choice(list(COMMANDS))
+                if command == "status":
+                    user_id = admin_id
+                update = make_update(bot, user_id, user_id, "private", f"/{command}")
+                handler = getattr(main, COMMANDS[command])
+            else:
+                update = make_update(bot, user_id, user_id, "private", rng.choice(PRIVATE_LINES))
+                handler = main.handle_message
+        context = SimpleNamespace(bot=bot, args=[], application=application)
+        started = time.perf_counter()
+        ARRIVAL.set(started)
+        if handler is main.handle_message:
+            await handler(update, context)
+        else:
+            sent = []
+            SENT.set(sent)
+            await handler(update, context)
+            if sent:
+                reply_latencies.append(sent[0] - started)
+        handle_latencies.append(time.perf_counter() - started)
+
+    total = int(args.rate * args.duration)
+    print(f"replaying {total} messages at {args.rate:g}/s "
+          f"({args.group_share:.0%} group, fake Gemini median {args.latency_ms:g}ms)...")
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    tasks = []
+    for _ in range(total):
+        await asyncio.sleep(rng.expovariate(args.rate))
+        tasks.append(asyncio.create_task(one_message()))
+    await asyncio.gather(*tasks)
+    # Let open group batches close and the scheduler drain
+    while True:
+        await asyncio.sleep(0.2)
+        queue = main.scheduler.get_metrics()
+        if (not queue["queue_depth"] and not queue["running"] and not main.group_batcher.get_stats()["open"]
+                and not main.send_queue.depth and not reply_tasks):
+            break
+    elapsed = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    await main.scheduler.stop()
+    await main.send_queue.shutdown()
+    reply_latencies.extend(sent[0] - arrival for arrival, sent in job_sends if sent)
+
+    print(f"\nmessages:        {total} in {elapsed:.1f}s ({total / elapsed:.1f} msg/s)")
+    print(f"replies sent:    {bot.sent} ({bot.sent / elapsed:.1f}/s), edits: {bot.edits}")
+    print(f"reply latency:   p50 {percentile(reply_latencies, 0.5) * 1000:.0f}ms  "
+          f"p95 {percentile(reply_latencies, 0.95) * 1000:.0f}ms  p99 {percentile(reply_latencies, 0.99) * 1000:.0f}ms")
+    print(f"handle_message:  p50 {percentile(handle_latencies, 0.5) * 1e6:.0f}us  "
+          f"p95 {percentile(handle_latencies, 0.95) * 1e6:.0f}us  p99 {percentile(handle_latencies, 0.99) * 1e6:.0f}us")
+    print(f"event loop cpu:  {cpu:.2f}s ({cpu / elapsed:.0%} of wall)")
+    print(f"fake gemini:     {gemini_stats}")
+    print(f"key pool:        {ai_chat.key_pool.get_stats()}")
+    print(f"group triage:    {main.group_triage.counts}")
+    print(f"group batching:  {main.group_batcher.get_stats()}")
+    print(f"scheduler:       {main.scheduler.get_metrics()}")
+    print(f"send queue:      {main.send_queue.get_stats()}")
+    print(f"history memory:  {ai_chat.history_budget.resident_bytes / 1024:.0f} KiB in {ai_chat.history_budget.resident_chats} chats")
+    print(f"max rss:         {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.stream:
+        os.environ["STREAM_REPLIES"] = "1"
+    # Keep admin_data.json, keywords and history out of the working tree
+    os.environ.setdefault("HISTORY_STORE", "memory")
+    os.environ.pop("WEBHOOK_URL", None)
+    os.environ.pop("METRICS_PORT", None)
+    os.chdir(tempfile.mkdtemp(prefix="naina-load-"))
+    asyncio.run(run(arguments))
@@ -0,0 +1,126 @@
+import time
+import asyncio
+import logging
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut, NetworkError
+from rate_limit import TokenBucket, retry_after_seconds
+from send_queue import PRIORITY_BULK
+from metrics import BROADCAST_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second across all chats for bulk sends
+BROADCAST_RATE = 25
+BROADCAST_CONCURRENCY = 20
+MAX_ATTEMPTS = 4
+PROGRESS_INTERVAL = 5.0
+
+# BadRequest messages meaning the chat is gone for good, not that the message was bad
+UNREACHABLE_ERRORS = ("chat not found", "user is deactivated", "group chat was deactivated", "peer_id_invalid")
+
+
+class BroadcastResult:
+    def __init__(self, total: int):
+        self.total = total
+        self.delivered = 0
+        self.failed = 0
+        self.unreachable = []
+        self.retries = 0
+        self.started_at = time.monotonic()
+
+    @property
+    def done(self) -> int:
+        return self.delivered + self.failed + len(self.unreachable)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def summary(self) -> str:
+        return (f"✅ Delivered: {self.delivered}/{self.total}\n"
+                f"❌ Failed: {self.failed}\n"
+                f"🚫 Blocked/gone (pruned): {len(self.unreachable)}\n"
+                f"🔁 Retries: {self.retries}\n"
+                f"⏱️ Took {self.elapsed:.1f}s")
+
+
+async def _send_with_retries(bot, chat_id, text: str, bucket: TokenBucket, result: BroadcastResult):
+    # Behind the bot's send queue, let replies to people overtake the broadcast
+    send_kwargs = {"rate_limit_args": {"priority": PRIORITY_BULK}} if getattr(bot, "rate_limiter", None) else {}
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        await bucket.acquire()
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, **send_kwargs)
+            result.delivered += 1
+            return
+        except RetryAfter as e:
+            # Flood limit is global for the bot, so hold every sender back, not just this one
+            bucket.pause(retry_after_seconds(e))
+        except Forbidden:
+            result.unreachable.append(chat_id)
+            return
+        except BadRequest as e:
+            if any(reason in str(e).lower() for reason in UNREACHABLE_ERRORS):
+                result.unreachable.append(chat_id)
+            else:
+                logger.error(f"Broadcast to {chat_id} rejected: {e}")
+                result.failed += 1
+            return
+        except (TimedOut, NetworkError) as e:
+            if attempt < MAX_ATTEMPTS:
+                await asyncio.sleep(2 ** attempt)
+            else:
+                logger.error(f"Broadcast to {chat_id} failed after {attempt} attempts: {e}")
+        except Exception as e:
+            logger.error(f"Broadcast to {chat_id} failed: {e}")
+            result.failed += 1
+            return
+        result.retries += 1
+    result.failed += 1
+
+
+async def run_broadcast(bot, targets: list, text: str, on_progress=None, on_unreachable=None,
+                        rate: float = BROADCAST_RATE, concurrency: int = BROADCAST_CONCURRENCY) -> BroadcastResult:
+    """Send text to every target concurrently under a global rate limit.
+
+    on_progress(result) is awaited every PROGRESS_INTERVAL seconds while sending;
+    on_unreachable(chat_id) is called for chats that blocked the bot or no longer exist.
+    """
+    result = BroadcastResult(len(targets))
+    bucket = TokenBucket(rate, capacity=rate)
+    queue = asyncio.Queue()
+    for chat_id in targets:
+        queue.put_nowait(chat_id)
+
+    async def worker():
+        while True:
+            try:
+                chat_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await _send_with_retries(bot, chat_id, text, bucket, result)
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            try:
+                await on_progress(result)
+            except Exception as e:
+                logger.error(f"Broadcast progress update failed: {e}")
+
+    report_task = asyncio.create_task(reporter()) if on_progress else None
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(targets)) or 1)))
+    finally:
+        if report_task:
+            report_task.cancel()
+
+    BROADCAST_MESSAGES.labels("delivered").inc(result.delivered)
+    BROADCAST_MESSAGES.labels("failed").inc(result.failed)
+    BROADCAST_MESSAGES.labels("unreachable").inc(len(result.unreachable))
+    BROADCAST_MESSAGES.labels("retried").inc(result.retries)
+    if on_unreachable:
+        for chat_id in result.unreachable:
+            on_unreachable(chat_id)
+    logger.info(f"Broadcast finished: {result.delivered}/{result.total} delivered, "
+                f"{result.failed} failed, {len(result.unreachable)} unreachable")
+    return result
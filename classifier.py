@@ -0,0 +1,99 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+CATEGORIES = ("dirty", "abuse", "advice")
+
+
+class MessageFlags:
+    """Which keyword categories a message hit; instances are shared, treat them as read-only"""
+
+    __slots__ = ("dirty", "abuse", "advice")
+
+    def __init__(self, dirty: bool = False, abuse: bool = False, advice: bool = False):
+        self.dirty = dirty
+        self.abuse = abuse
+        self.advice = advice
+
+    def __repr__(self):
+        return f"MessageFlags(dirty={self.dirty}, abuse={self.abuse}, advice={self.advice})"
+
+
+def _trie_pattern(words) -> str:
+    """Build a prefix-factored alternation ("ba(?:d|t)" rather than "bad|bat") so the regex
+    engine tests each shared prefix once instead of once per keyword"""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node) -> str:
+        is_end = "" in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch != ""]
+        if not branches:
+            return ""
+        if len(branches) == 1 and not is_end:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        return group + "?" if is_end else group
+
+    return build(trie)
+
+
+class KeywordClassifier:
+    """Matches a message against every keyword category with one compiled regex pass.
+
+    The message is lowercased once and scanned with a single prefix-factored regex. With
+    the shipped lists (a few dozen keywords) that is only ~1.1-1.3x faster than the old
+    substring loops; the gain is that it stays flat as KEYWORDS_FILE grows, ~5x faster at
+    ~450 keywords (benchmarks/bench_classifier.py).
+    Keywords only match as whole words, so "ass" no longer fires on "class" or "pass".
+    reload() builds the new pattern first and swaps it in with a single assignment, so
+    concurrent classify() calls always see a complete rule set.
+    """
+
+    # One precomputed MessageFlags per combination of category bits
+    _FLAGS = [
+        MessageFlags(*(bool(mask & (1 << bit)) for bit in range(len(CATEGORIES))))
+        for mask in range(1 << len(CATEGORIES))
+    ]
+
+    def __init__(self, categories: dict):
+        self._rules = None
+        self.categories = {}
+        self.reload(categories)
+
+    def reload(self, categories: dict):
+        self.categories = {category: list(keywords) for category, keywords in categories.items()}
+        keyword_masks = {}
+        for category, keywords in categories.items():
+            bit = 1 << CATEGORIES.index(category)
+            for keyword in keywords:
+                keyword = keyword.strip().lower()
+                if keyword:
+                    keyword_masks[keyword] = keyword_masks.get(keyword, 0) | bit
+        pattern = re.compile(r"\b(?:" + _trie_pattern(keyword_masks) + r")\b") if keyword_masks else None
+        self._rules = (pattern, keyword_masks)
+        logger.info(f"Keyword classifier loaded {len(keyword_masks)} keywords")
+
+    def classify(self, message: str) -> MessageFlags:
+        return self._FLAGS[self.classify_mask(message)]
+
+    def classify_mask(self, message: str) -> int:
+        """Category bits (1 << CATEGORIES.index(category)) the message hit"""
+        pattern, keyword_masks = self._rules
+        if pattern is None or not message:
+            return 0
+        found = 0
+        # findall hands back plain strings, skipping a match object per hit
+        for keyword in pattern.findall(message.lower()):
+            found |= keyword_masks[keyword]
+        return found
+
+    @classmethod
+    def flags_for(cls, mask: int) -> MessageFlags:
+        return cls._FLAGS[mask]
@@ -0,0 +1,128 @@
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from classifier import KeywordClassifier
+
+logger = logging.getLogger(__name__)
+
+_worker_classifier = None
+_worker_generation = None
+
+
+def _init_worker():
+    logging.getLogger("classifier").setLevel(logging.WARNING)
+
+
+def _classify_batch(generation: int, categories: dict, messages: list) -> list:
+    global _worker_classifier, _worker_generation
+    if generation != _worker_generation:
+        _worker_classifier = KeywordClassifier(categories)
+        _worker_generation = generation
+    classify = _worker_classifier.classify_mask
+    return [classify(message) for message in messages]
+
+
+class CpuPool:
+    """Optional process pool for the CPU-bound part of message handling.
+
+    Only messages of at least min_chars go to the pool: shorter ones are cheaper to
+    classify inline than to pickle (see benchmarks/bench_cpu_pool.py). Calls arriving within
+    max_delay of each other travel as one batch, so one IPC round trip serves many messages.
+    Workers only send back category bitmasks.
+
+    All workers are forked up front, so create the pool before the process starts threads
+    or opens SQLite connections: forking later can copy a lock some other thread holds and
+    deadlock the child. They are never re-forked. Each batch carries the keyword lists
+    (a few hundred bytes) with a generation number, and a worker rebuilds its
+    KeywordClassifier when the generation changes, so reload() needs no restart.
+    """
+
+    def __init__(self, workers: int, categories: dict = None, min_chars: int = 1000,
+                 batch_size: int = 64, max_delay: float = 0.002):
+        self.workers = workers
+        self.min_chars = min_chars
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.batches = 0
+        self.items = 0
+        self._pending = []
+        self._timer = None
+        self._categories = dict(categories or {})
+        self._generation = 0
+        # fork keeps start-up cheap; spawn and forkserver would re-import main.py in every worker
+        context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+        self._executor = ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker)
+        # With fork the executor starts every worker on its first submit, so submit now
+        self._executor.submit(_init_worker)
+
+    def reload(self, categories: dict):
+        """Use new keyword lists from the next batch on; batches already sent finish on the old ones"""
+        self._categories = dict(categories)
+        self._generation += 1
+
+    def wants(self, message: str) -> bool:
+        return len(message) >= self.min_chars
+
+    async def classify_mask(self, message: str) -> int:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((message, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        self.batches += 1
+        self.items += len(batch)
+        loop = asyncio.get_running_loop()
+        done = loop.run_in_executor(self._executor, _classify_batch, self._generation, self._categories,
+                                    [message for message, _ in batch])
+
+        def resolve(result):
+            error = result.exception()
+            masks = result.result() if error is None else None
+            for index, (_, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(masks[index])
+
+        done.add_done_callback(resolve)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 1) if self.batches else 0.0,
+        }
+
+
+def create_cpu_pool(categories: dict = None):
+    """Opt-in via CPU_POOL_WORKERS > 0; tuned with CPU_POOL_MIN_CHARS, _BATCH and _DELAY_MS.
+    Call it early (see CpuPool) and hand it the keyword lists later through reload()."""
+    workers = int(os.environ.get("CPU_POOL_WORKERS", "0"))
+    if workers <= 0:
+        return None
+    return CpuPool(
+        workers,
+        categories,
+        min_chars=int(os.environ.get("CPU_POOL_MIN_CHARS", "1000")),
+        batch_size=int(os.environ.get("CPU_POOL_BATCH", "64")),
+        max_delay=float(os.environ.get("CPU_POOL_DELAY_MS", "2")) / 1000,
+    )
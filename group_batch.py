@@ -0,0 +1,73 @@
+import os
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class GroupBurstBatcher:
+    """Collects lines that arrive in a group within `window` seconds of the first one
+    and hands them over together, so a burst costs one model call instead of one per line.
+
+    A batch is flushed when the window closes or once it holds `max_batch` lines.
+    """
+
+    def __init__(self, window: float = 1.5, max_batch: int = 8):
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._batches = {}  # chat_id -> (lines, on_flush, timer)
+        self.batches = 0
+        self.lines = 0
+
+    def is_open(self, chat_id: str) -> bool:
+        return chat_id in self._batches
+
+    def add(self, chat_id: str, line, on_flush=None):
+        """Queue a line for chat_id. on_flush(lines) is required when no batch is open
+        and is called synchronously once the batch closes."""
+        self.lines += 1
+        batch = self._batches.get(chat_id)
+        if batch is None:
+            if self.window <= 0 or self.max_batch == 1:
+                self.batches += 1
+                on_flush([line])
+                return
+            timer = asyncio.get_running_loop().call_later(self.window, self.flush, chat_id)
+            batch = self._batches[chat_id] = ([], on_flush, timer)
+        batch[0].append(line)
+        if len(batch[0]) >= self.max_batch:
+            self.flush(chat_id)
+
+    def flush(self, chat_id: str):
+        batch = self._batches.pop(chat_id, None)
+        if batch is None:
+            return
+        lines, on_flush, timer = batch
+        timer.cancel()
+        self.batches += 1
+        try:
+            on_flush(lines)
+        except Exception as e:
+            logger.error(f"Flushing group batch for {chat_id} failed: {e}")
+
+    def close(self):
+        """Drop pending batches without answering them, at shutdown"""
+        for lines, _, timer in self._batches.values():
+            timer.cancel()
+        self._batches.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "lines": self.lines,
+            "calls_saved": self.lines - self.batches,
+            "open": len(self._batches),
+        }
+
+
+def create_group_batcher() -> GroupBurstBatcher:
+    """Configured by GROUP_BATCH_WINDOW (seconds, 0 disables) and GROUP_BATCH_MAX"""
+    return GroupBurstBatcher(
+        window=float(os.environ.get("GROUP_BATCH_WINDOW", "1.5")),
+        max_batch=int(os.environ.get("GROUP_BATCH_MAX", "8")),
+    )
@@ -0,0 +1,86 @@
+import os
+import re
+import time
+import logging
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+QUESTION_WORDS = re.compile(
+    r"\b(kya|kyu|kyun|kyon|kaise|kaisa|kaisi|kab|kaun|kon|kahan|kaha|kidhar|kitna|kitne|kitni|"
+    r"what|why|how|who|when|where|which|can|should|anyone|koi)\b"
+)
+
+
+class GroupTriage:
+    """Cheap local rules deciding which group messages deserve a model reply.
+
+    Mentions, replies to the bot and messages using her name are direct address and skip
+    the cooldown; questions only get a reply once the group's cooldown has passed. Every
+    reply spends from the group's hourly budget, and nothing else reaches the model.
+    """
+
+    def __init__(self, bot_names=("naina",), cooldown: float = 30.0, replies_per_hour: float = 60):
+        self.name_pattern = re.compile(r"\b(" + "|".join(re.escape(name.lower()) for name in bot_names) + r")\b")
+        self.cooldown = cooldown
+        self.replies_per_hour = replies_per_hour
+        self.budget_overrides = {}
+        self._last_reply = {}
+        self._buckets = {}
+        self.counts = {}
+
+    def set_budget(self, chat_id: str, replies_per_hour: float):
+        self.budget_overrides[chat_id] = replies_per_hour
+        self._buckets.pop(chat_id, None)
+
+    def budget_for(self, chat_id: str) -> float:
+        return self.budget_overrides.get(chat_id, self.replies_per_hour)
+
+    def _bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            per_hour = self.budget_for(chat_id)
+            # Allow a short burst of a tenth of the hourly budget, at least one reply
+            bucket = self._buckets[chat_id] = TokenBucket(per_hour / 3600, capacity=max(1.0, per_hour / 10))
+        return bucket
+
+    def _count(self, reason: str):
+        self.counts[reason] = self.counts.get(reason, 0) + 1
+
+    def decide(self, chat_id: str, text: str, mentioned: bool = False, replied_to_bot: bool = False):
+        """Returns (should_reply, reason)"""
+        text_lower = text.lower()
+        if mentioned:
+            reason = "mention"
+        elif replied_to_bot:
+            reason = "reply"
+        elif self.name_pattern.search(text_lower):
+            reason = "name"
+        elif "?" in text or QUESTION_WORDS.search(text_lower):
+            reason = "question"
+        else:
+            self._count("ignored")
+            return False, "ignored"
+
+        now = time.monotonic()
+        if reason == "question" and now - self._last_reply.get(chat_id, 0.0) < self.cooldown:
+            self._count("cooldown")
+            return False, "cooldown"
+        if self.budget_for(chat_id) <= 0 or not self._bucket(chat_id).try_acquire():
+            self._count("over_budget")
+            return False, "over_budget"
+
+        self._last_reply[chat_id] = now
+        self._count(reason)
+        return True, reason
+
+
+def create_group_triage(budget_overrides: dict = None) -> GroupTriage:
+    """Configured by GROUP_REPLY_COOLDOWN (seconds) and GROUP_REPLIES_PER_HOUR"""
+    triage = GroupTriage(
+        cooldown=float(os.environ.get("GROUP_REPLY_COOLDOWN", "30")),
+        replies_per_hour=float(os.environ.get("GROUP_REPLIES_PER_HOUR", "60")),
+    )
+    for chat_id, replies_per_hour in (budget_overrides or {}).items():
+        triage.set_budget(chat_id, replies_per_hour)
+    return triage
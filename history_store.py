@@ -0,0 +1,545 @@
+import os
+import sys
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from google.genai import types
+from token_budget import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HISTORY_DB_FILE = "bot_data.db"
+# Rough per-turn cost of the Turn object and its cached types.Content around the message text
+TURN_OVERHEAD_BYTES = 400
+
+
+def turn_size(text: str) -> int:
+    return sys.getsizeof(text) + TURN_OVERHEAD_BYTES
+
+
+class Turn:
+    """One message in a history; the types.Content for it is built once and reused on every request"""
+
+    __slots__ = ("role", "text", "tokens", "_content")
+
+    def __init__(self, role: str, text: str):
+        self.role = role
+        self.text = text
+        self.tokens = estimate_tokens(text)
+        self._content = None
+
+    @property
+    def content(self) -> types.Content:
+        if self._content is None:
+            self._content = types.Content(role=self.role, parts=[types.Part(text=self.text)])
+        return self._content
+
+
+class TurnBuffer:
+    """Fixed-size ring of turns; appending past max_turns drops the oldest turn in place.
+
+    summary holds a running digest of turns that were folded out of the ring by the summarizer.
+    """
+
+    __slots__ = ("turns", "next_seq", "summary")
+
+    def __init__(self, max_turns: int, turns=(), next_seq: int = 0, summary: str = ""):
+        self.turns = deque(turns, maxlen=max_turns)
+        self.next_seq = next_seq
+        self.summary = summary
+
+    @property
+    def first_seq(self) -> int:
+        return self.next_seq - len(self.turns)
+
+    def append(self, role: str, text: str):
+        """Add a turn and return the turn pushed out of the ring, if any"""
+        dropped = self.turns[0] if len(self.turns) == self.turns.maxlen else None
+        self.turns.append(Turn(role, text))
+        return dropped
+
+    def contents(self) -> list:
+        return [turn.content for turn in self.turns]
+
+    def window(self, max_tokens: int):
+        """Newest turns that fit in max_tokens, oldest first, with their estimated token total.
+
+        The newest turn is always included even if it alone is over budget, and the window
+        never starts with a model turn.
+        """
+        picked = []
+        total = 0
+        for turn in reversed(self.turns):
+            if picked and total + turn.tokens > max_tokens:
+                break
+            picked.append(turn)
+            total += turn.tokens
+        while len(picked) > 1 and picked[-1].role == "model":
+            total -= picked.pop().tokens
+        picked.reverse()
+        return [turn.content for turn in picked], total
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def __iter__(self):
+        return iter(self.turns)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self.turns)[index]
+        return self.turns[index]
+
+
+def open_database(path: str) -> sqlite3.Connection:
+    """Open a SQLite connection in WAL mode, shareable with the flush thread"""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class MemoryHistoryStore:
+    """Default store: keeps nothing beyond the resident histories, so restarts start fresh"""
+
+    durable = False
+
+    def load(self, mode: str, chat_id: str) -> list:
+        return []
+
+    def has(self, mode: str, chat_id: str) -> bool:
+        return False
+
+    def chat_ids(self, mode: str) -> list:
+        return []
+
+    def append(self, mode: str, chat_id: str, seq: int, role: str, text: str):
+        pass
+
+    def trim(self, mode: str, chat_id: str, min_seq: int):
+        pass
+
+    def clear(self, mode: str, chat_id: str):
+        pass
+
+    def clear_mode(self, mode: str):
+        pass
+
+    def load_summary(self, mode: str, chat_id: str) -> str:
+        return ""
+
+    def save_summary(self, mode: str, chat_id: str, summary: str):
+        pass
+
+    def flush(self) -> int:
+        return 0
+
+    def close(self):
+        pass
+
+
+class SQLiteHistoryStore(MemoryHistoryStore):
+    """SQLite-backed store with write-behind: changes queue in memory until flush() commits them in one transaction.
+
+    Reads never flush. They go through a second WAL connection, so they don't wait for a
+    commit in progress, and replay the queued changes for their chat on top of what they
+    read. Queued changes are dropped only once committed, and replaying a change the
+    database already has is harmless (every change is an upsert or a delete).
+    """
+
+    durable = True
+
+    # op -> statement; params always start with (mode, chat_id), except clear_mode's (mode,)
+    _SQL = {
+        "append": "INSERT OR REPLACE INTO turns (mode, chat_id, seq, role, text) VALUES (?, ?, ?, ?, ?)",
+        "trim": "DELETE FROM turns WHERE mode = ? AND chat_id = ? AND seq < ?",
+        "clear": "DELETE FROM turns WHERE mode = ? AND chat_id = ?",
+        "clear_summary": "DELETE FROM summaries WHERE mode = ? AND chat_id = ?",
+        "clear_mode": "DELETE FROM turns WHERE mode = ?",
+        "clear_mode_summaries": "DELETE FROM summaries WHERE mode = ?",
+        "summary": "INSERT OR REPLACE INTO summaries (mode, chat_id, summary) VALUES (?, ?, ?)",
+    }
+
+    def __init__(self, path: str = DEFAULT_HISTORY_DB_FILE):
+        self.path = path
+        self._conn = open_database(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "mode TEXT NOT NULL, chat_id TEXT NOT NULL, seq INTEGER NOT NULL, "
+            "role TEXT NOT NULL, text TEXT NOT NULL, "
+            "PRIMARY KEY (mode, chat_id, seq)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "mode TEXT NOT NULL, chat_id TEXT NOT NULL, summary TEXT NOT NULL, "
+            "PRIMARY KEY (mode, chat_id)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+        self._reader = open_database(path)
+        # _db_lock serializes use of the write connection and _read_lock of the read one;
+        # _pending_lock only guards the queue, so the event loop never waits behind a disk write
+        self._db_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = []
+        self._pending_keys = {}  # (mode, chat_id or None for a whole mode) -> queued ops
+
+    @staticmethod
+    def _key(op: str, params: tuple):
+        return (params[0], None) if op.startswith("clear_mode") else (params[0], params[1])
+
+    def _queue(self, op: str, params: tuple):
+        key = self._key(op, params)
+        with self._pending_lock:
+            self._pending.append((op, params))
+            self._pending_keys[key] = self._pending_keys.get(key, 0) + 1
+
+    def _apply_pending(self) -> int:
+        with self._pending_lock:
+            ops = list(self._pending)
+        if not ops:
+            return 0
+        # Consecutive ops with the same statement go through one executemany
+        batch_op, batch = None, []
+        for op, params in ops:
+            if op != batch_op and batch:
+                self._conn.executemany(self._SQL[batch_op], batch)
+                batch = []
+            batch_op = op
+            batch.append(params)
+        if batch:
+            self._conn.executemany(self._SQL[batch_op], batch)
+        self._conn.commit()
+        with self._pending_lock:
+            del self._pending[:len(ops)]
+            for op, params in ops:
+                key = self._key(op, params)
+                remaining = self._pending_keys.pop(key) - 1
+                if remaining:
+                    self._pending_keys[key] = remaining
+        return len(ops)
+
+    def flush(self) -> int:
+        with self._db_lock:
+            try:
+                return self._apply_pending()
+            except Exception as e:
+                # The ops stay queued and go out with the next flush
+                self._conn.rollback()
+                logger.error(f"Error flushing history store: {e}")
+                return 0
+
+    def _pending_for(self, mode: str, chat_id: str = None) -> list:
+        """Queued ops that affect this chat (or, without chat_id, any chat of this mode)"""
+        with self._pending_lock:
+            if chat_id is None:
+                if not any(key[0] == mode for key in self._pending_keys):
+                    return []
+                return [(op, params) for op, params in self._pending if params[0] == mode]
+            if (mode, chat_id) not in self._pending_keys and (mode, None) not in self._pending_keys:
+                return []
+            return [(op, params) for op, params in self._pending
+                    if params[0] == mode and (op.startswith("clear_mode") or params[1] == chat_id)]
+
+    def _read(self, sql: str, params: tuple) -> list:
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    def _load_with_pending(self, mode: str, chat_id: str):
+        """Turns as {seq: (role, text)} and the summary, with queued ops applied"""
+        ops = self._pending_for(mode, chat_id)
+        turns = {seq: (role, text) for seq, role, text in self._read(
+            "SELECT seq, role, text FROM turns WHERE mode = ? AND chat_id = ?", (mode, chat_id))}
+        rows = self._read("SELECT summary FROM summaries WHERE mode = ? AND chat_id = ?", (mode, chat_id))
+        summary = rows[0][0] if rows else ""
+        for op, params in ops:
+            if op == "append":
+                turns[params[2]] = (params[3], params[4])
+            elif op == "trim":
+                turns = {seq: turn for seq, turn in turns.items() if seq >= params[2]}
+            elif op in ("clear", "clear_mode"):
+                turns = {}
+            elif op in ("clear_summary", "clear_mode_summaries"):
+                summary = ""
+            elif op == "summary":
+                summary = params[2]
+        return turns, summary
+
+    def load(self, mode: str, chat_id: str) -> list:
+        turns, _ = self._load_with_pending(mode, chat_id)
+        return [(seq, role, text) for seq, (role, text) in sorted(turns.items())]
+
+    def has(self, mode: str, chat_id: str) -> bool:
+        if self._pending_for(mode, chat_id):
+            return bool(self._load_with_pending(mode, chat_id)[0])
+        return bool(self._read("SELECT 1 FROM turns WHERE mode = ? AND chat_id = ? LIMIT 1", (mode, chat_id)))
+
+    def chat_ids(self, mode: str) -> list:
+        ops = self._pending_for(mode)
+        chat_ids = {row[0] for row in self._read("SELECT DISTINCT chat_id FROM turns WHERE mode = ?", (mode,))}
+        for op, params in ops:
+            if op == "append":
+                chat_ids.add(params[1])
+            elif op == "clear":
+                chat_ids.discard(params[1])
+            elif op == "clear_mode":
+                chat_ids.clear()
+        return list(chat_ids)
+
+    def append(self, mode: str, chat_id: str, seq: int, role: str, text: str):
+        self._queue("append", (mode, chat_id, seq, role, text))
+
+    def trim(self, mode: str, chat_id: str, min_seq: int):
+        self._queue("trim", (mode, chat_id, min_seq))
+
+    def clear(self, mode: str, chat_id: str):
+        self._queue("clear", (mode, chat_id))
+        self._queue("clear_summary", (mode, chat_id))
+
+    def clear_mode(self, mode: str):
+        self._queue("clear_mode", (mode,))
+        self._queue("clear_mode_summaries", (mode,))
+
+    def load_summary(self, mode: str, chat_id: str) -> str:
+        if self._pending_for(mode, chat_id):
+            return self._load_with_pending(mode, chat_id)[1]
+        rows = self._read("SELECT summary FROM summaries WHERE mode = ? AND chat_id = ?", (mode, chat_id))
+        return rows[0][0] if rows else ""
+
+    def save_summary(self, mode: str, chat_id: str, summary: str):
+        self._queue("summary", (mode, chat_id, summary))
+
+    def close(self):
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+        with self._read_lock:
+            self._reader.close()
+
+
+def create_history_store():
+    """Pick the store from HISTORY_STORE ("memory" or "sqlite") and HISTORY_DB_FILE"""
+    backend = os.environ.get("HISTORY_STORE", "memory").lower()
+    if backend == "sqlite":
+        path = os.environ.get("HISTORY_DB_FILE", DEFAULT_HISTORY_DB_FILE)
+        logger.info(f"Using SQLite history store at {path}")
+        return SQLiteHistoryStore(path)
+    return MemoryHistoryStore()
+
+
+class HistoryBudget:
+    """Global memory budget shared by every ChatHistories, evicting the least recently used chats.
+
+    Evicted chats only leave memory: their turns are already queued in the store, so with a
+    durable store they reload on next use, and with the memory store they start fresh.
+    """
+
+    def __init__(self, max_bytes: int, idle_ttl: float = 0):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.resident_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._histories = {}
+        self._lru = OrderedDict()
+
+    def register(self, histories):
+        self._histories[histories.mode] = histories
+
+    def touch(self, mode: str, chat_id: str):
+        key = (mode, chat_id)
+        entry = self._lru.get(key)
+        if entry is not None:
+            entry[0] = time.monotonic()
+            self._lru.move_to_end(key)
+
+    def resize(self, mode: str, chat_id: str, delta: int):
+        key = (mode, chat_id)
+        entry = self._lru.get(key)
+        if entry is None:
+            entry = self._lru[key] = [time.monotonic(), 0]
+        else:
+            entry[0] = time.monotonic()
+            self._lru.move_to_end(key)
+        entry[1] += delta
+        self.resident_bytes += delta
+        while self.resident_bytes > self.max_bytes and len(self._lru) > 1:
+            oldest = next(iter(self._lru))
+            if oldest == key:
+                break
+            self._evict(oldest)
+            self.evictions += 1
+
+    def forget(self, mode: str, chat_id: str):
+        entry = self._lru.pop((mode, chat_id), None)
+        if entry is not None:
+            self.resident_bytes -= entry[1]
+
+    def forget_mode(self, mode: str):
+        for key in [key for key in self._lru if key[0] == mode]:
+            self.forget(*key)
+
+    def _evict(self, key):
+        self.forget(*key)
+        histories = self._histories.get(key[0])
+        if histories is not None:
+            histories.evict(key[1])
+
+    def evict_idle(self) -> int:
+        """Drop chats idle for longer than idle_ttl; returns how many were evicted"""
+        if not self.idle_ttl:
+            return 0
+        cutoff = time.monotonic() - self.idle_ttl
+        count = 0
+        while self._lru:
+            key, entry = next(iter(self._lru.items()))
+            if entry[0] > cutoff:
+                break
+            self._evict(key)
+            count += 1
+        self.expirations += count
+        return count
+
+    @property
+    def resident_chats(self) -> int:
+        return len(self._lru)
+
+
+def create_history_budget(durable: bool = False):
+    """Budget from HISTORY_MEMORY_BUDGET_MB and HISTORY_IDLE_TTL (seconds, 0 disables).
+
+    Idle expiry defaults to 6 hours with a durable store, where evicted chats reload, and is
+    off with the memory store, where eviction would forget the chat for good.
+    """
+    max_mb = float(os.environ.get("HISTORY_MEMORY_BUDGET_MB", "64"))
+    idle_ttl = float(os.environ.get("HISTORY_IDLE_TTL", "21600" if durable else "0"))
+    return HistoryBudget(int(max_mb * 1024 * 1024), idle_ttl)
+
+
+class ChatHistories(MutableMapping):
+    """chat_id -> TurnBuffer for one mode, loaded lazily from the store when a chat first speaks"""
+
+    def __init__(self, mode: str, max_turns: int, store, budget=None):
+        self.mode = mode
+        self.max_turns = max_turns
+        self.store = store
+        self.budget = budget
+        self._resident = {}
+        if budget is not None:
+            budget.register(self)
+
+    def _resize(self, chat_id: str, delta: int):
+        if self.budget is not None:
+            self.budget.resize(self.mode, chat_id, delta)
+
+    def _forget(self, chat_id: str):
+        if self.budget is not None:
+            self.budget.forget(self.mode, chat_id)
+
+    def evict(self, chat_id: str):
+        """Drop a chat from memory only; the store keeps whatever it has"""
+        self._resident.pop(chat_id, None)
+
+    def _load(self, chat_id: str):
+        rows = self.store.load(self.mode, chat_id)
+        if not rows:
+            return None
+        rows = rows[-self.max_turns:]
+        summary = self.store.load_summary(self.mode, chat_id)
+        history = TurnBuffer(self.max_turns, (Turn(role, text) for _, role, text in rows), rows[-1][0] + 1, summary)
+        self._resident[chat_id] = history
+        self._resize(chat_id, sum(turn_size(text) for _, _, text in rows) + (turn_size(summary) if summary else 0))
+        return history
+
+    def __getitem__(self, chat_id: str) -> TurnBuffer:
+        history = self._resident.get(chat_id)
+        if history is None:
+            history = self._load(chat_id)
+            if history is None:
+                raise KeyError(chat_id)
+        elif self.budget is not None:
+            self.budget.touch(self.mode, chat_id)
+        return history
+
+    def __contains__(self, chat_id) -> bool:
+        return chat_id in self._resident or self.store.has(self.mode, chat_id)
+
+    def __setitem__(self, chat_id: str, history):
+        self._forget(chat_id)
+        self.store.clear(self.mode, chat_id)
+        self._resident[chat_id] = TurnBuffer(self.max_turns)
+        # Register even an empty history, so the budget tracks and can expire it
+        self._resize(chat_id, 0)
+        for turn in history:
+            self.add_turn(chat_id, turn.role, turn.text)
+
+    def __delitem__(self, chat_id: str):
+        if chat_id not in self:
+            raise KeyError(chat_id)
+        self.evict(chat_id)
+        self._forget(chat_id)
+        self.store.clear(self.mode, chat_id)
+
+    def _chat_ids(self) -> list:
+        chat_ids = list(self._resident)
+        resident = set(chat_ids)
+        chat_ids.extend(chat_id for chat_id in self.store.chat_ids(self.mode) if chat_id not in resident)
+        return chat_ids
+
+    def __iter__(self):
+        return iter(self._chat_ids())
+
+    def __len__(self) -> int:
+        return len(self._chat_ids())
+
+    def clear(self):
+        self._resident.clear()
+        if self.budget is not None:
+            self.budget.forget_mode(self.mode)
+        self.store.clear_mode(self.mode)
+
+    def resident_items(self) -> list:
+        return list(self._resident.items())
+
+    def fold_into_summary(self, chat_id: str, history: TurnBuffer, folded: list, summary: str) -> bool:
+        """Replace the oldest turns of `history` (the `folded` list, in order) with a new
+        running summary.
+
+        `history` is the buffer the summary was written from. If the chat was cleared,
+        evicted or reloaded meanwhile it is no longer the loaded one, and the summary is
+        dropped (False) rather than leaking into the fresh history. Turns that arrived while
+        the summary was being written stay put; if the ring already dropped or replaced the
+        folded turns, only the ones still at the front are removed.
+        """
+        if self._resident.get(chat_id) is not history:
+            return False
+        delta = turn_size(summary) - (turn_size(history.summary) if history.summary else 0)
+        for turn in folded:
+            if not history.turns or history.turns[0] is not turn:
+                continue
+            history.turns.popleft()
+            delta -= turn_size(turn.text)
+        history.summary = summary
+        self.store.save_summary(self.mode, chat_id, summary)
+        self.store.trim(self.mode, chat_id, history.first_seq)
+        self._resize(chat_id, delta)
+        return True
+
+    def add_turn(self, chat_id: str, role: str, text: str):
+        history = self._resident.get(chat_id)
+        if history is None:
+            history = self._load(chat_id)
+            if history is None:
+                history = self._resident[chat_id] = TurnBuffer(self.max_turns)
+        seq = history.next_seq
+        history.next_seq += 1
+        dropped = history.append(role, text)
+        self.store.append(self.mode, chat_id, seq, role, text)
+        delta = turn_size(text)
+        if dropped is not None:
+            delta -= turn_size(dropped.text)
+            self.store.trim(self.mode, chat_id, seq - self.max_turns + 1)
+        self._resize(chat_id, delta)
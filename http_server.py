@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+READ_TIMEOUT = 10.0
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HttpRequest:
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method: str, path: str, query: dict, headers: dict, body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+
+class HttpResponse:
+    __slots__ = ("status", "body", "content_type")
+
+    def __init__(self, status: int = 200, body=b"", content_type: str = "text/plain; charset=utf-8"):
+        self.status = status
+        self.body = body.encode() if isinstance(body, str) else body
+        self.content_type = content_type
+
+
+class HttpServer:
+    """Tiny asyncio HTTP/1.1 server for the bot's own endpoints (metrics, health, webhook).
+
+    Routes map (method, path) to an async handler(request) -> HttpResponse. One request per
+    connection; bodies are read by Content-Length only.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._routes = {}
+        self._server = None
+
+    def route(self, method: str, path: str, handler):
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        if len(head) > MAX_HEADER_BYTES:
+            return HttpResponse(413, "Headers too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            return HttpResponse(400, "Bad request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            return HttpResponse(400, "Bad Content-Length")
+        if length > MAX_BODY_BYTES:
+            return HttpResponse(413, "Body too large")
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(target)
+        return HttpRequest(method.upper(), url.path, parse_qs(url.query), headers, body)
+
+    async def _dispatch(self, request: HttpRequest) -> HttpResponse:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return HttpResponse(405, "Method not allowed")
+            return HttpResponse(404, "Not found")
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"HTTP handler for {request.method} {request.path} failed: {e}")
+            return HttpResponse(500, "Internal error")
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                request = await asyncio.wait_for(self._read_request(reader), READ_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            response = request if isinstance(request, HttpResponse) else await self._dispatch(request)
+            reason = REASONS.get(response.status, "")
+            writer.write(
+                f"HTTP/1.1 {response.status} {reason}\r\n"
+                f"Content-Type: {response.content_type}\r\n"
+                f"Content-Length: {len(response.body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + response.body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,145 @@
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if code == 429:
+        return True
+    text = str(error)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text
+
+
+class ApiKey:
+    """One Gemini key with its own circuit breaker.
+
+    closed: normal use. After failure_threshold consecutive failures the breaker opens and
+    the key is skipped until cooldown_until; the cool-down doubles with every further
+    failure up to max_cooldown. Once it expires the key is half-open: one probe request is
+    let through, and a success closes the breaker again.
+    """
+
+    def __init__(self, name: str, api_key: str, client_factory):
+        self.name = name
+        self.api_key = api_key
+        self._client_factory = client_factory
+        self._client = None
+        self.in_flight = 0
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.probing = False
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._client_factory(self.api_key)
+        return self._client
+
+    @property
+    def state(self) -> str:
+        if self.cooldown_until == 0.0:
+            return "closed"
+        if time.monotonic() < self.cooldown_until:
+            return "open"
+        return "half-open"
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half-open" and not self.probing)
+
+
+class GeminiKeyPool:
+    """Hands out the least-loaded healthy key, rotating between equally loaded ones"""
+
+    def __init__(self, keys: list, client_factory, failure_threshold: int = 2,
+                 base_cooldown: float = 5.0, rate_limit_cooldown: float = 30.0, max_cooldown: float = 600.0):
+        self.keys = [ApiKey(name, api_key, client_factory) for name, api_key in keys]
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = base_cooldown
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.max_cooldown = max_cooldown
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def acquire(self, exclude=()):
+        """Reserve a healthy key, or return None at once if every key is cooling down"""
+        count = len(self.keys)
+        best = None
+        for offset in range(count):
+            key = self.keys[(self._next + offset) % count]
+            if key in exclude or not key.available():
+                continue
+            if best is None or key.in_flight < best.in_flight:
+                best = key
+        if best is None:
+            return None
+        self._next = (self.keys.index(best) + 1) % count
+        if best.state == "half-open":
+            best.probing = True
+        best.in_flight += 1
+        best.calls += 1
+        return best
+
+    def release(self, key: ApiKey, error: Exception = None):
+        key.in_flight -= 1
+        key.probing = False
+        if error is None:
+            key.successes += 1
+            key.consecutive_failures = 0
+            key.cooldown_until = 0.0
+            return
+
+        key.failures += 1
+        key.consecutive_failures += 1
+        rate_limited = is_rate_limit_error(error)
+        if rate_limited:
+            key.rate_limited += 1
+        if rate_limited or key.consecutive_failures >= self.failure_threshold:
+            base = self.rate_limit_cooldown if rate_limited else self.base_cooldown
+            streak = max(0, key.consecutive_failures - self.failure_threshold)
+            cooldown = min(self.max_cooldown, base * (2 ** streak))
+            key.cooldown_until = time.monotonic() + cooldown
+            logger.warning(f"Gemini key {key.name} cooling down for {cooldown:.0f}s after: {error}")
+
+    def healthy_count(self) -> int:
+        return sum(1 for key in self.keys if key.state != "open")
+
+    def get_stats(self) -> list:
+        now = time.monotonic()
+        return [{
+            "name": key.name,
+            "state": key.state,
+            "in_flight": key.in_flight,
+            "calls": key.calls,
+            "successes": key.successes,
+            "failures": key.failures,
+            "rate_limited": key.rate_limited,
+            "cooldown_left": round(max(0.0, key.cooldown_until - now), 1),
+        } for key in self.keys]
+
+
+def load_api_keys() -> list:
+    """GEMINI_API_KEY, GEMINI_API_KEY_BACKUP, then any extra comma-separated GEMINI_API_KEYS"""
+    keys = []
+    primary = os.environ.get("GEMINI_API_KEY")
+    if primary:
+        keys.append(("primary", primary))
+    backup = os.environ.get("GEMINI_API_KEY_BACKUP")
+    if backup:
+        keys.append(("backup", backup))
+    extra = [key.strip() for key in os.environ.get("GEMINI_API_KEYS", "").split(",") if key.strip()]
+    known = {api_key for _, api_key in keys}
+    for index, api_key in enumerate(extra, start=1):
+        if api_key not in known:
+            keys.append((f"key{index}", api_key))
+            known.add(api_key)
+    return keys
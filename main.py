@@ -5,21 +5,39 @@ import random
 import time
 import json
 import sys
+import secrets
+import signal
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes, JobQueue
+from telegram.ext import Application, MessageHandler, CallbackQueryHandler, TypeHandler, filters, ContextTypes, JobQueue
+from telegram.request import HTTPXRequest
 
 # Load environment variables from .env file if it exists
 load_dotenv()
 from ai_chat import (
-    get_ai_response, get_group_response, add_to_group_history,
+    get_ai_response, get_group_burst_response, add_to_group_history,
     clear_conversation, clear_group_conversation, clear_all_data,
     is_dirty_message, get_dirty_response, get_sticker_for_mood,
-    is_abuse_message, get_abuse_response, is_advice_message,
+    is_abuse_message, get_abuse_response, is_advice_message, classify_message, classify_message_async, reload_keywords, cpu_pool,
     save_user_preference, get_custom_abuse_response, get_stats, get_lover_response,
-    conversation_history, get_random_joke, get_random_quote, get_daily_tip,
+    conversation_history, history_store, history_budget, key_pool, summarize_histories, get_random_joke, get_random_quote, get_daily_tip,
     get_random_compliment, get_random_fortune, get_random_dare, get_random_truth
 )
+from scheduler import ChatScheduler
+from persistence import DebouncedJsonWriter, SharedStateStore
+from streaming import StreamingReply, PRIVATE_EDIT_INTERVAL, GROUP_EDIT_INTERVAL
+from broadcast import run_broadcast
+from group_triage import create_group_triage
+from group_batch import create_group_batcher
+from user_directory import create_user_directory, user_label
+from access import Access, AccessTable
+from pagination import CALLBACK_PREFIX as LIST_CALLBACK_PREFIX, PAGE_SIZE, keyset_page, decode_cursor, page_keyboard, format_age
+from metrics import UPDATE_SECONDS, REPLY_SECONDS, TELEGRAM_SECONDS, Gauge, render_metrics, status_summary
+from http_server import HttpServer, HttpResponse
+from webhook import make_webhook_handler, serve_webhook
+from routing import CommandRouter, install_update_counters, allowed_updates_for
+from sharding import ShardFront, WorkerSupervisor, WORKER_UPDATE_PATH, serve_shard_front
+from send_queue import create_send_queue
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -30,7 +48,30 @@ logger = logging.getLogger(__name__)
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 ADMIN_USERNAME = "CoffinWifi"
 ADMIN_DATA_FILE = "admin_data.json"
-BOT_DATA_FILE = "bot_data.json"
+ADMIN_DATA_FLUSH_INTERVAL = float(os.environ.get("ADMIN_DATA_FLUSH_INTERVAL", "2"))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("HISTORY_FLUSH_INTERVAL", "5"))
+SUMMARY_INTERVAL = float(os.environ.get("SUMMARY_INTERVAL", "60"))
+# Opt-in: serve Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+# Setting WEBHOOK_URL (the bot's public https base URL) switches from long polling to a
+# webhook served on PORT, which also answers GET /health for uptime checks
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+PORT = int(os.environ.get("PORT", "8080"))
+# SHARD_COUNT > 1 runs a front process that starts SHARD_COUNT workers (`python main.py`
+# with SHARD_INDEX set) on SHARD_BASE_PORT.. and hands each update to the worker owning its chat
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "1"))
+SHARD_INDEX = int(os.environ["SHARD_INDEX"]) if os.environ.get("SHARD_INDEX") else None
+SHARD_BASE_PORT = int(os.environ.get("SHARD_BASE_PORT", "9100"))
+# Admin data lives in admin_data.json, or in SQLite shared between shards (ADMIN_STORE=sqlite,
+# implied by sharding), where workers pick up each other's changes every ADMIN_SYNC_INTERVAL
+ADMIN_STORE = "sqlite" if SHARD_COUNT > 1 else os.environ.get("ADMIN_STORE", "json").lower()
+ADMIN_DB_FILE = os.environ.get("ADMIN_DB_FILE", "bot_data.db")
+ADMIN_SYNC_INTERVAL = float(os.environ.get("ADMIN_SYNC_INTERVAL", "1"))
+# Opt-in: show replies as they stream from Gemini via throttled message edits
+STREAM_REPLIES = os.environ.get("STREAM_REPLIES", "").lower() in ("1", "true", "yes")
 
 BOT_START_TIME = time.time()
 
@@ -43,12 +84,22 @@ muted_users = {}
 abuse_targets = {}
 lover_targets = {}
 user_chat_history = {}
-username_to_id = {}
 blocked_naughty_users = {}
 bot_enabled = True
 group_auto_reply = True
 tracked_groups = set()  # Track group/channel IDs for broadcasting
 
+group_reply_budgets = {}  # chat_id -> replies per hour, overriding GROUP_REPLIES_PER_HOUR
+group_triage = create_group_triage()
+group_batcher = create_group_batcher()
+deferred_group_lines = {}  # chat_id -> lines waiting in the chat's queue for a CPU pool classification
+user_directory = create_user_directory()
+
+# Per-chat FIFO with round-robin fairness between chats for AI replies
+scheduler = ChatScheduler(max_workers=int(os.environ.get("CHAT_WORKERS", "8")))
+# Every outgoing Bot API call is paced per chat and globally, admins' chats first
+send_queue = create_send_queue(urgent_chat=lambda chat_id: chat_id in admin_ids, shards=SHARD_COUNT)
+
 GENTLE_REJECTION_MESSAGES = [
     "Hey! Aise baatein nahi karte na. 🥺",
     "Nahi, please. Mujhe yeh bilkul pasand nahi hai. 🥺",
@@ -70,9 +121,7 @@ def resolve_user_id(identifier: str) -> str:
     identifier = identifier.replace("@", "").strip().lower()
     if identifier.isdigit():
         return identifier
-    if identifier in username_to_id:
-        return str(username_to_id[identifier])
-    return None
+    return user_directory.resolve(identifier)
 
 
 async def keep_alive_job(context: ContextTypes.DEFAULT_TYPE):
@@ -90,56 +139,152 @@ async def keep_alive_job(context: ContextTypes.DEFAULT_TYPE):
             logger.error(f"Failed to send keep-alive: {e}")
 
 
-def add_username_mapping(user_id: int, username: str):
-    if username:
-        username_to_id[username.lower()] = str(user_id)
+def add_username_mapping(update: Update):
+    """Record the sender in the user directory; memory only, flush_user_directory_job writes it out"""
+    user = update.effective_user
+    user_directory.touch(user.id, user.username, user.first_name, update.effective_chat.id)
+
+
+def compute_access(user_id: str) -> Access:
+    return Access(
+        user_id,
+        owner=admin_chat_id is not None and str(admin_chat_id) == user_id,
+        admin=user_id in admin_ids,
+        blocked=user_id in blocked_users,
+        muted=user_id in muted_users,
+        lover=user_id in lover_targets,
+        dirty=user_id in dirty_talk_permissions,
+    )
+
+
+# Rebuilt lazily after every save_admin_data() / apply_admin_data()
+access_table = AccessTable(compute_access)
+
+
+async def attach_access(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs before every handler: look the sender's Access up once and hang it on the context"""
+    if update.effective_user is not None:
+        context.access = access_table.get(update.effective_user.id)
+
+
+def user_access(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Access:
+    """The sender's Access for this update, from attach_access or looked up now"""
+    access = getattr(context, "access", None)
+    if access is None:
+        access = context.access = access_table.get(update.effective_user.id)
+    return access
+
+
+def apply_admin_data(data: dict):
+    global admin_chat_id, admin_ids, blocked_users, muted_users, abuse_targets, lover_targets, blocked_naughty_users, bot_enabled, group_auto_reply, tracked_groups, group_reply_budgets, dirty_talk_permissions
+    admin_chat_id = data.get('admin_chat_id')
+    tracked_groups = set(data.get('tracked_groups', []))
+    admin_ids = set(data.get('admin_ids', []))
+    blocked_users = data.get('blocked_users', {})
+    muted_users = data.get('muted_users', {})
+    abuse_targets = data.get('abuse_targets', {})
+    lover_targets = data.get('lover_targets', {})
+    blocked_naughty_users = data.get('blocked_naughty_users', {})
+    dirty_talk_permissions = data.get('dirty_talk_permissions', {})
+    bot_enabled = data.get('bot_enabled', True)
+    group_auto_reply = data.get('group_auto_reply', True)
+    group_reply_budgets = data.get('group_reply_budgets', {})
+    for group_id, replies_per_hour in group_reply_budgets.items():
+        group_triage.set_budget(group_id, replies_per_hour)
+    access_table.invalidate()
 
 
 def load_admin_data():
-    global admin_chat_id, admin_ids, blocked_users, muted_users, abuse_targets, lover_targets, blocked_naughty_users, bot_enabled, group_auto_reply, tracked_groups
     try:
-        if os.path.exists(ADMIN_DATA_FILE):
+        if ADMIN_STORE == "sqlite" and not admin_data_writer.is_empty():
+            apply_admin_data(admin_data_writer.load())
+        elif os.path.exists(ADMIN_DATA_FILE):
             with open(ADMIN_DATA_FILE, 'r') as f:
-                data = json.load(f)
-                admin_chat_id = data.get('admin_chat_id')
-                tracked_groups = set(data.get('tracked_groups', []))
-                admin_ids = set(data.get('admin_ids', []))
-                blocked_users = data.get('blocked_users', {})
-                muted_users = data.get('muted_users', {})
-                abuse_targets = data.get('abuse_targets', {})
-                lover_targets = data.get('lover_targets', {})
-                blocked_naughty_users = data.get('blocked_naughty_users', {})
-                bot_enabled = data.get('bot_enabled', True)
-                group_auto_reply = data.get('group_auto_reply', True)
-                logger.info(f"Loaded admin data. Admin chat ID: {admin_chat_id}, Admin IDs: {admin_ids}")
+                apply_admin_data(json.load(f))
+            # First start on the shared store: seed it from the JSON file, unless another worker just did
+            if ADMIN_STORE == "sqlite" and not admin_data_writer.seed(admin_data_snapshot()):
+                apply_admin_data(admin_data_writer.load())
+        else:
+            return
+        logger.info(f"Loaded admin data. Admin chat ID: {admin_chat_id}, Admin IDs: {admin_ids}")
     except Exception as e:
         logger.error(f"Error loading admin data: {e}")
 
 
+def admin_data_snapshot() -> dict:
+    return {
+        'admin_chat_id': admin_chat_id,
+        'admin_ids': list(admin_ids),
+        'blocked_users': dict(blocked_users),
+        'muted_users': dict(muted_users),
+        'abuse_targets': dict(abuse_targets),
+        'lover_targets': dict(lover_targets),
+        'blocked_naughty_users': dict(blocked_naughty_users),
+        'bot_enabled': bot_enabled,
+        'group_auto_reply': group_auto_reply,
+        'tracked_groups': list(tracked_groups),
+        'group_reply_budgets': dict(group_reply_budgets),
+        'dirty_talk_permissions': dict(dirty_talk_permissions)
+    }
+
+
+if ADMIN_STORE == "sqlite":
+    admin_data_writer = SharedStateStore(ADMIN_DB_FILE, admin_data_snapshot)
+else:
+    admin_data_writer = DebouncedJsonWriter(ADMIN_DATA_FILE, admin_data_snapshot)
+
+
 def save_admin_data():
-    try:
-        with open(ADMIN_DATA_FILE, 'w') as f:
-            json.dump({
-                'admin_chat_id': admin_chat_id,
-                'admin_ids': list(admin_ids),
-                'blocked_users': blocked_users,
-                'muted_users': muted_users,
-                'abuse_targets': abuse_targets,
-                'lover_targets': lover_targets,
-                'blocked_naughty_users': blocked_naughty_users,
-                'bot_enabled': bot_enabled,
-                'group_auto_reply': group_auto_reply,
-                'tracked_groups': list(tracked_groups)
-            }, f)
-    except Exception as e:
-        logger.error(f"Error saving admin data: {e}")
+    """Mark admin data dirty; flush_admin_data_job writes it out at most once per interval.
+    Every change to admin data ends here, so cached Access records are dropped too."""
+    access_table.invalidate()
+    admin_data_writer.mark_dirty()
+
+
+async def flush_admin_data_job(context: ContextTypes.DEFAULT_TYPE):
+    await admin_data_writer.flush()
+
+
+async def sync_admin_data_job(context: ContextTypes.DEFAULT_TYPE):
+    """Shared store: push our changes, then pick up blocks, mutes etc. made on other shards"""
+    await admin_data_writer.flush()
+    if not await asyncio.to_thread(admin_data_writer.changed_elsewhere):
+        return
+    rows, version = await asyncio.to_thread(admin_data_writer.read)
+    if admin_data_writer.dirty:
+        # A handler changed something while we were reading; push it first, reload next round.
+        # Nothing was accepted, so changed_elsewhere() stays true until we do.
+        return
+    apply_admin_data(admin_data_writer.accept(rows, version))
+
+
+async def flush_history_job(context: ContextTypes.DEFAULT_TYPE):
+    """Commit queued conversation writes to the history store off the event loop"""
+    await asyncio.to_thread(history_store.flush)
+
+
+async def flush_user_directory_job(context: ContextTypes.DEFAULT_TYPE):
+    await asyncio.to_thread(user_directory.flush)
+
+
+async def summarize_job(context: ContextTypes.DEFAULT_TYPE):
+    """Fold old turns of long conversations into running summaries, off the reply path"""
+    folded = await summarize_histories()
+    if folded:
+        logger.info(f"Summarized {folded} long conversations")
+
+
+async def evict_idle_history_job(context: ContextTypes.DEFAULT_TYPE):
+    evicted = history_budget.evict_idle()
+    if evicted:
+        logger.info(f"Evicted {evicted} idle conversations from memory")
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global admin_chat_id, admin_ids
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    add_username_mapping(user_id, update.effective_user.username)
+    add_username_mapping(update)
     
     if update.effective_chat.type == "private":
         if not admin_chat_id:
@@ -159,62 +304,156 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    started = time.perf_counter()
+    try:
+        await route_message(update, context)
+    finally:
+        UPDATE_SECONDS.labels(update.effective_chat.type).observe(time.perf_counter() - started)
+
+
+async def route_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not bot_enabled:
         return
     
-    user_id = update.effective_user.id
     username = update.effective_user.username
     chat_id = update.effective_chat.id
     message_text = update.message.text
+    user_name = update.effective_user.first_name or username or "User"
     
-    add_username_mapping(user_id, username)
+    add_username_mapping(update)
     
-    user_id_str = str(user_id)
+    access = user_access(update, context)
+    user_id_str = access.user_id
     chat_id_str = str(chat_id)
     
     # Track group/channel
     if update.effective_chat.type in ["group", "supergroup", "channel"]:
-        tracked_groups.add(chat_id_str)
-        save_admin_data()
+        if chat_id_str not in tracked_groups:
+            tracked_groups.add(chat_id_str)
+            save_admin_data()
         
-        if not group_auto_reply or user_id_str in muted_users or user_id in blocked_users:
+        if not group_auto_reply or access.muted or access.blocked:
             return
         
-        if is_abuse_message(message_text):
-            response = get_custom_abuse_response(user_id_str, message_text, "hindi")
-            await context.bot.send_message(chat_id=chat_id, text=response)
+        if cpu_pool and (cpu_pool.wants(message_text) or chat_id_str in deferred_group_lines):
+            # The CPU pool answers asynchronously, so a shorter line behind this one could be
+            # routed first; route this line, and the chat's next ones, from its queue instead
+            classification = asyncio.ensure_future(classify_message_async(message_text))
+            deferred_group_lines[chat_id_str] = deferred_group_lines.get(chat_id_str, 0) + 1
+            if not scheduler.submit(chat_id_str, lambda: route_deferred_group_line(
+                    update, context, user_id_str, user_name, message_text, classification)):
+                release_deferred_group_line(chat_id_str)
             return
         
-        response = get_group_response(user_id_str, message_text)
-        add_to_group_history(user_id_str, message_text, response)
-        await context.bot.send_message(chat_id=chat_id, text=response)
+        route_group_line(update, context, user_id_str, user_name, message_text, classify_message(message_text))
     else:
         # Private chat
-        if user_id_str in blocked_users or user_id_str in muted_users:
+        if access.blocked or access.muted:
+            return
+        
+        scheduler.submit(chat_id_str, lambda: reply_in_private(context, chat_id, access, user_name, message_text))
+
+
+def route_group_line(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id_str: str, user_name: str, message_text: str, flags):
+    """Answer abuse, join an open burst, or let triage decide whether the line gets a reply"""
+    chat_id = update.effective_chat.id
+    chat_id_str = str(chat_id)
+    if flags.abuse:
+        scheduler.submit(chat_id_str, lambda: send_abuse_reply(context, chat_id, user_id_str, user_name, message_text))
+        return
+    
+    if group_batcher.is_open(chat_id_str):
+        # A reply to this burst is already on its way; answer this line in the same call
+        group_batcher.add(chat_id_str, (user_name, message_text))
+        return
+    
+    reply_to = update.message.reply_to_message
+    mentioned = bool(context.bot.username) and f"@{context.bot.username.lower()}" in message_text.lower()
+    replied_to_bot = bool(reply_to and reply_to.from_user and reply_to.from_user.id == context.bot.id)
+    should_reply, reason = group_triage.decide(chat_id_str, message_text, mentioned, replied_to_bot)
+    if not should_reply:
+        # Keep the line as context for the next reply, without a model call
+        scheduler.submit(chat_id_str, lambda: note_group_message(chat_id_str, user_name, message_text))
+        return
+    
+    group_batcher.add(chat_id_str, (user_name, message_text),
+                      lambda lines: scheduler.submit(chat_id_str, lambda: reply_in_group(context, chat_id, lines)))
+
+
+async def route_deferred_group_line(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id_str: str, user_name: str, message_text: str, classification):
+    chat_id_str = str(update.effective_chat.id)
+    try:
+        route_group_line(update, context, user_id_str, user_name, message_text, await classification)
+    finally:
+        release_deferred_group_line(chat_id_str)
+
+
+def release_deferred_group_line(chat_id_str: str):
+    remaining = deferred_group_lines.pop(chat_id_str) - 1
+    if remaining:
+        deferred_group_lines[chat_id_str] = remaining
+
+
+async def note_group_message(chat_id_str: str, user_name: str, message_text: str):
+    add_to_group_history(chat_id_str, user_name, message_text)
+
+
+def queue_reply(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str):
+    """Hand a plain reply to the send queue without waiting for it to go out.
+
+    The chat's next job can start while the reply waits for a token, so replies that pile
+    up behind the chat's rate limit meet in the queue and go out as one message, in order.
+    """
+    context.application.create_task(context.bot.send_message(chat_id=chat_id, text=text))
+
+
+async def send_abuse_reply(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id_str: str, user_name: str, message_text: str):
+    response = await get_abuse_response(user_id_str, message_text, user_name)
+    queue_reply(context, chat_id, response)
+
+
+async def reply_in_group(context: ContextTypes.DEFAULT_TYPE, chat_id: int, lines: list):
+    with REPLY_SECONDS.labels("group").time():
+        if STREAM_REPLIES:
+            stream = StreamingReply(context.bot, chat_id, GROUP_EDIT_INTERVAL)
+            response = await get_group_burst_response(str(chat_id), lines, on_partial=stream.update)
+            await stream.finish(response)
             return
         
+        response = await get_group_burst_response(str(chat_id), lines)
+        queue_reply(context, chat_id, response)
+
+
+async def reply_in_private(context: ContextTypes.DEFAULT_TYPE, chat_id: int, access: Access, user_name: str, message_text: str):
+    with REPLY_SECONDS.labels("private").time():
+        user_id_str = access.user_id
+        # Classified here, in the chat's queue, so a long message waiting on the CPU pool
+        # can't be overtaken by a shorter one sent after it
+        flags = await classify_message_async(message_text)
         if user_id_str not in conversation_history:
             conversation_history[user_id_str] = []
         
-        if is_abuse_message(message_text):
-            response = get_custom_abuse_response(user_id_str, message_text, "hindi")
-            await context.bot.send_message(chat_id=chat_id, text=response)
+        if flags.abuse:
+            await send_abuse_reply(context, chat_id, user_id_str, user_name, message_text)
             return
         
-        if is_advice_message(message_text):
+        if flags.advice:
             save_user_preference(user_id_str, message_text)
         
-        if user_id_str in lover_targets:
-            response = get_lover_response(user_id_str, message_text)
-        elif user_id_str in dirty_talk_permissions:
-            response = get_dirty_response(user_id_str, message_text)
-        else:
-            response = get_ai_response(user_id_str, message_text)
+        stream = StreamingReply(context.bot, chat_id, PRIVATE_EDIT_INTERVAL) if STREAM_REPLIES else None
+        on_partial = stream.update if stream else None
         
-        conversation_history[user_id_str].append({"role": "user", "content": message_text})
-        conversation_history[user_id_str].append({"role": "assistant", "content": response})
+        if access.lover:
+            response = await get_lover_response(user_id_str, message_text, user_name, on_partial=on_partial)
+        elif access.dirty:
+            response = await get_dirty_response(user_id_str, message_text, user_name, on_partial=on_partial)
+        else:
+            response = await get_ai_response(user_id_str, message_text, user_name, on_partial=on_partial)
         
-        await context.bot.send_message(chat_id=chat_id, text=response)
+        if stream:
+            await stream.finish(response)
+        else:
+            queue_reply(context, chat_id, response)
 
 
 async def handle_sticker(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -229,9 +468,7 @@ async def handle_sticker(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -251,9 +488,7 @@ async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -262,6 +497,7 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uptime_mins = int((uptime % 3600) // 60)
     
     stats = get_stats()
+    queue = scheduler.get_metrics()
     
     status_msg = f"""
 🤖 **BOT STATUS**
@@ -269,15 +505,22 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ⏰ Uptime: {uptime_hours}h {uptime_mins}m
 👥 Total Users: {len(conversation_history)}
 📊 Stats: {stats}
+🎯 Group triage: {group_triage.counts}
+🧺 Group batching: {group_batcher.get_stats()}
+📇 User directory: {user_directory.get_stats()}
+🧩 Shard: {SHARD_INDEX if SHARD_INDEX is not None else 0} of {SHARD_COUNT}
+📥 Queue: {queue['queue_depth']} pending in {queue['queued_chats']} chats, {queue['running']} running
+⏱️ Wait: avg {queue['avg_wait_ms']}ms, max {queue['max_wait_ms']}ms
+📮 Send queue: {send_queue.get_stats()}
+📈 Performance:
+{status_summary()}
 """
     await update.message.reply_text(status_msg)
 
 
 async def stop_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global bot_enabled
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -288,9 +531,7 @@ async def stop_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def resume_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global bot_enabled
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -300,9 +541,7 @@ async def resume_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def block_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -321,9 +560,7 @@ async def block_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def unblock_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -342,9 +579,7 @@ async def unblock_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def mute_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -363,9 +598,7 @@ async def mute_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def unmute_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -384,9 +617,7 @@ async def unmute_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def abuse_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -405,9 +636,7 @@ async def abuse_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def unabuse_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -427,9 +656,7 @@ async def unabuse_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def reset_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global conversation_history, dirty_talk_permissions, pending_permissions, blocked_users, muted_users, abuse_targets, lover_targets, blocked_naughty_users
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -446,21 +673,29 @@ async def reset_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def restart_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
     await update.message.reply_text("🔄 Restarting... bye! 👋")
-    os.system("pkill -f 'python main.py'")
+    # A shard asks its front to restart the whole set; either way shutdown hooks still flush data
+    os.kill(os.getppid() if SHARD_INDEX is not None else os.getpid(), signal.SIGTERM)
+
+
+async def reload_keywords_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not user_access(update, context).admin:
+        await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
+        return
+    
+    if reload_keywords():
+        await update.message.reply_text("✅ Keywords reloaded!")
+    else:
+        await update.message.reply_text("❌ Failed to reload keywords, check the logs.")
 
 
 async def group_on(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global group_auto_reply
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -471,9 +706,7 @@ async def group_on(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def group_off(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global group_auto_reply
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -482,58 +715,116 @@ async def group_off(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("🔇 Group auto-reply DISABLED!")
 
 
-async def list_blocked(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+async def group_budget(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
-    if not blocked_users:
-        await update.message.reply_text("No blocked users!")
+    args = context.args or []
+    if len(args) == 1 and update.effective_chat.type != "private":
+        group_id, value = str(update.effective_chat.id), args[0]
+    elif len(args) == 2:
+        group_id, value = args[0], args[1]
+    else:
+        await update.message.reply_text("Usage: /groupbudget <replies_per_hour> (in a group) or /groupbudget <chat_id> <replies_per_hour>")
         return
     
-    blocked_list = "\n".join(blocked_users.keys())
-    await update.message.reply_text(f"🚫 **BLOCKED USERS:**\n{blocked_list}")
+    try:
+        replies_per_hour = float(value)
+    except ValueError:
+        await update.message.reply_text("Invalid number!")
+        return
+    
+    group_reply_budgets[group_id] = replies_per_hour
+    group_triage.set_budget(group_id, replies_per_hour)
+    save_admin_data()
+    await update.message.reply_text(f"✅ Group {group_id} can now get {replies_per_hour:g} AI replies per hour!")
+
+
+# listing -> (title, reply when empty, the admin dict or set it pages through)
+LISTINGS = {
+    "blocked": ("🚫 **BLOCKED USERS", "No blocked users!", lambda: blocked_users),
+    "muted": ("🔇 **MUTED USERS", "No muted users!", lambda: muted_users),
+    "abuse": ("😈 **ABUSE TARGETS", "No abuse targets!", lambda: abuse_targets),
+    "admins": ("👑 **ADMINS", "No admins!", lambda: admin_ids),
+    "lovers": ("❤️ **MY LOVERS", "No lovers! 💔", lambda: lover_targets),
+    "naughty": ("🔒 **NAUGHTY-BLOCKED USERS", "No users blocked from naughty talk!", lambda: blocked_naughty_users),
+    "users": ("👥 **USERS", "No users yet!", None),
+    "groups": ("👥 **GROUPS", "No groups yet!", None),
+}
+
+
+def render_listing(listing: str, days: int = 0, after=None, before=None):
+    """Text and ◀️/▶️ keyboard for one page of an admin listing.
+
+    Only that page is built: admin dicts are paged by key through a bounded heap, users
+    and groups by keyset queries on the user directory, so a reply stays far below
+    Telegram's 4096-character limit however many entries there are.
+    """
+    title, empty, source = LISTINGS[listing]
+    since = time.time() - days * 86400 if days else 0.0
+    if listing == "users":
+        rows, more = user_directory.page_users(after, before, PAGE_SIZE, since)
+        total = user_directory.count_users(since)
+        keys = [row[0] for row in rows]
+        lines = [f"{user_id} {user_label(username, first_name)} · {format_age(last_seen)}"
+                 for user_id, username, first_name, last_seen in rows]
+    elif listing == "groups":
+        rows, more = user_directory.page_groups(after, before, PAGE_SIZE, since)
+        total = user_directory.count_groups(since)
+        keys = [row[0] for row in rows]
+        lines = [f"{chat_id} · {members} members · {format_age(last_seen)}" for chat_id, members, last_seen in rows]
+    else:
+        entries = source()
+        keys, more = keyset_page(entries, after, before, PAGE_SIZE)
+        total = len(entries)
+        labels = user_directory.labels(keys)
+        lines = [f"{key} {labels.get(key, '')}".rstrip() for key in keys]
 
+    if not keys:
+        if after is not None or before is not None:
+            # Everything past the cursor is gone since the page was sent; start over
+            return render_listing(listing, days)
+        return empty, None
+    has_prev, has_next = (more, True) if before is not None else (after is not None, more)
+    active = f", active in {days}d" if days else ""
+    text = f"{title} ({total}{active}):**\n" + "\n".join(lines)
+    return text, page_keyboard(listing, days, keys[0], keys[-1], has_prev, has_next)
 
-async def list_muted(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+
+async def send_listing(update: Update, listing: str, days: int = 0):
+    text, keyboard = render_listing(listing, days)
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+
+async def list_blocked(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
-    if not muted_users:
-        await update.message.reply_text("No muted users!")
+    await send_listing(update, "blocked")
+
+
+async def list_muted(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not user_access(update, context).admin:
+        await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
-    muted_list = "\n".join(muted_users.keys())
-    await update.message.reply_text(f"🔇 **MUTED USERS:**\n{muted_list}")
+    await send_listing(update, "muted")
 
 
 async def list_abuse(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
-    if not abuse_targets:
-        await update.message.reply_text("No abuse targets!")
-        return
-    
-    abuse_list = "\n".join(abuse_targets.keys())
-    await update.message.reply_text(f"😈 **ABUSE TARGETS:**\n{abuse_list}")
+    await send_listing(update, "abuse")
 
 
 async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id != str(update.effective_user.id) or user_id not in admin_ids:
-        if user_id != "@CoffinWifi":
-            await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
-            return
+    if not user_access(update, context).admin:
+        await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
+        return
     
     if not context.args:
         await update.message.reply_text("Usage: /addadmin <user_id>")
@@ -549,9 +840,8 @@ async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def remove_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id != "@CoffinWifi":
+    # Only the owner can take admin rights away
+    if not user_access(update, context).owner:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -569,24 +859,15 @@ async def remove_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def list_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
-    if not admin_ids:
-        await update.message.reply_text("No admins!")
-        return
-    
-    admins_list = "\n".join(admin_ids)
-    await update.message.reply_text(f"👑 **ADMINS:**\n{admins_list}")
+    await send_listing(update, "admins")
 
 
 async def add_lover(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -605,9 +886,7 @@ async def add_lover(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def remove_lover(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -626,24 +905,15 @@ async def remove_lover(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def list_lovers(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
-    if not lover_targets:
-        await update.message.reply_text("No lovers! 💔")
-        return
-    
-    lovers_list = "\n".join(lover_targets.keys())
-    await update.message.reply_text(f"❤️ **MY LOVERS:**\n{lovers_list}")
+    await send_listing(update, "lovers")
 
 
 async def block_naughty(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -662,9 +932,7 @@ async def block_naughty(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def unblock_naughty(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -683,31 +951,24 @@ async def unblock_naughty(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def list_blocked_naughty(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
-    if not blocked_naughty_users:
-        await update.message.reply_text("No users blocked from naughty talk!")
-        return
-    
-    blocked_list = "\n".join(blocked_naughty_users.keys())
-    await update.message.reply_text(f"🔒 **NAUGHTY-BLOCKED USERS:**\n{blocked_list}")
+    await send_listing(update, "naughty")
 
 
 async def handle_permission_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    user_id = query.from_user.id
     
-    if str(user_id) != admin_chat_id:
+    if not user_access(update, context).owner:
         await query.answer("You're not the admin!", show_alert=True)
         return
     
     if query.data.startswith("approve_"):
         requester_id = query.data.split("_")[1]
         dirty_talk_permissions[requester_id] = True
+        save_admin_data()
         await query.edit_message_text(f"✅ Dirty talk approved for {requester_id}! 🔥")
     
     elif query.data.startswith("deny_"):
@@ -716,6 +977,24 @@ async def handle_permission_callback(update: Update, context: ContextTypes.DEFAU
         await query.edit_message_text(f"❌ Dirty talk denied for {requester_id}.")
 
 
+async def handle_listing_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """◀️/▶️ on an admin listing: swap the message for the neighbouring page"""
+    query = update.callback_query
+    
+    if not user_access(update, context).admin:
+        await query.answer("You're not the admin!", show_alert=True)
+        return
+    
+    try:
+        listing, days, after, before = decode_cursor(query.data)
+        text, keyboard = render_listing(listing, days, after, before)
+    except (ValueError, KeyError):
+        await query.answer("This list is out of date, run the command again.", show_alert=True)
+        return
+    await query.answer()
+    await query.edit_message_text(text, reply_markup=keyboard)
+
+
 async def tell_joke(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     joke = get_random_joke()
@@ -795,16 +1074,18 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /mute @user - Mute user
 /abuse @user - Target for gaalis
 /lover @user - Mark as lover
+/listusers [days] [groups] - Browse users or groups
 """
     await update.message.reply_text(help_text)
 
 
 async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    is_admin = "✅ Yes" if user_id in admin_ids else "❌ No"
-    is_blocked = "✅ Yes" if user_id in blocked_users else "❌ No"
-    is_muted = "✅ Yes" if user_id in muted_users else "❌ No"
-    is_lover = "❤️ Yes" if user_id in lover_targets else "❌ No"
+    access = user_access(update, context)
+    user_id = access.user_id
+    is_admin = "✅ Yes" if access.admin else "❌ No"
+    is_blocked = "✅ Yes" if access.blocked else "❌ No"
+    is_muted = "✅ Yes" if access.muted else "❌ No"
+    is_lover = "❤️ Yes" if access.lover else "❌ No"
     
     info = f"""
 📱 **YOUR INFO WITH NAINA**
@@ -818,9 +1099,7 @@ async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def view_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -835,31 +1114,29 @@ async def view_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     history = conversation_history[target][-20:]
     chat_display = ""
-    for msg in history:
-        chat_display += f"**{msg['role']}:** {msg['content']}\n\n"
+    for turn in history:
+        chat_display += f"**{turn.role}:** {turn.text}\n\n"
     
     await update.message.reply_text(f"📜 Last 20 messages with {target}:\n\n{chat_display}")
 
 
 async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
-    if not conversation_history:
-        await update.message.reply_text("No users yet!")
-        return
-    
-    users_list = "\n".join(conversation_history.keys())
-    await update.message.reply_text(f"👥 **TOTAL USERS ({len(conversation_history)}):**\n{users_list}")
+    # /listusers [days] [groups]: only those active in the last N days, or group chats instead
+    listing, days = "users", 0
+    for arg in context.args:
+        if arg.lower() == "groups":
+            listing = "groups"
+        elif arg.lower().rstrip("d").isdigit():
+            days = int(arg.lower().rstrip("d"))
+    await send_listing(update, listing, days)
 
 
 async def broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    if user_id not in admin_ids:
+    if not user_access(update, context).admin:
         await update.message.reply_text(random.choice(RUDE_REJECTION_MESSAGES))
         return
     
@@ -868,23 +1145,39 @@ async def broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     message = " ".join(context.args)
-    count = 0
+    text = f"📢 **BROADCAST FROM ADMIN:**\n\n{message}"
+    # The directory also knows private chats whose history was evicted from memory
+    private_chats = set(conversation_history.keys())
+    private_chats.update(user_directory.private_chat_ids())
+    targets = list(private_chats) + list(tracked_groups)
     
-    for user in conversation_history.keys():
-        try:
-            await context.bot.send_message(chat_id=user, text=f"📢 **BROADCAST FROM ADMIN:**\n\n{message}")
-            count += 1
-        except:
-            pass
-    
-    for group in tracked_groups:
-        try:
-            await context.bot.send_message(chat_id=group, text=f"📢 **BROADCAST FROM ADMIN:**\n\n{message}")
-            count += 1
-        except:
-            pass
+    status_message = await update.message.reply_text(f"📢 Broadcast started to {len(targets)} users/groups...")
+    context.application.create_task(run_broadcast_job(context.bot, targets, text, status_message), update=update)
+
+
+def prune_unreachable_chat(chat_id):
+    """Forget a chat that blocked the bot or no longer exists so broadcasts stop trying it"""
+    chat_id = str(chat_id)
+    if chat_id in tracked_groups:
+        tracked_groups.discard(chat_id)
+        save_admin_data()
+    else:
+        clear_conversation(chat_id)
+        user_directory.forget_private_chat(chat_id)
+
+
+async def run_broadcast_job(bot, targets: list, text: str, status_message):
+    async def report(result):
+        await status_message.edit_text(
+            f"📢 Broadcasting... {result.done}/{result.total}\n"
+            f"✅ {result.delivered} delivered, ❌ {result.failed} failed, 🚫 {len(result.unreachable)} blocked"
+        )
     
-    await update.message.reply_text(f"✅ Message sent to {count} users/groups!")
+    result = await run_broadcast(bot, targets, text, on_progress=report, on_unreachable=prune_unreachable_chat)
+    try:
+        await status_message.edit_text(f"📢 **BROADCAST DONE**\n\n{result.summary()}")
+    except Exception as e:
+        logger.error(f"Failed to post broadcast summary: {e}")
 
 
 async def clear_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -902,64 +1195,150 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Update {update} caused error {context.error}")
 
 
+class InstrumentedRequest(HTTPXRequest):
+    """Times every Bot API call, labelled by method (sendMessage, editMessageText, ...)"""
+    
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            TELEGRAM_SECONDS.labels(url.rsplit("/", 1)[-1]).observe(time.perf_counter() - started)
+
+
+Gauge("naina_scheduler_queue_depth", "Messages waiting for a worker", lambda: scheduler.get_metrics()["queue_depth"])
+Gauge("naina_scheduler_running", "Reply jobs in progress", lambda: scheduler.get_metrics()["running"])
+Gauge("naina_send_queue_depth", "Bot API calls waiting in the send queue", lambda: send_queue.depth)
+Gauge("naina_resident_chats", "Chat histories held in memory", lambda: history_budget.resident_chats)
+Gauge("naina_healthy_gemini_keys", "Gemini keys whose circuit breaker is not open", key_pool.healthy_count)
+
+metrics_server = None
+
+
+async def serve_metrics(request):
+    return HttpResponse(200, render_metrics(), "text/plain; version=0.0.4; charset=utf-8")
+
+
+async def serve_health(request):
+    queue = scheduler.get_metrics()
+    health = {
+        "status": "ok" if bot_enabled else "stopped",
+        "uptime": int(time.time() - BOT_START_TIME),
+        "queue_depth": queue["queue_depth"],
+        "running": queue["running"],
+    }
+    return HttpResponse(200, json.dumps(health), "application/json")
+
+
+async def on_startup(application: Application):
+    global metrics_server
+    scheduler.start()
+    if METRICS_PORT:
+        metrics_server = HttpServer(METRICS_HOST, METRICS_PORT + (SHARD_INDEX or 0))
+        metrics_server.route("GET", "/metrics", serve_metrics)
+        metrics_server.route("GET", "/health", serve_health)
+        await metrics_server.start()
+
+
+async def on_shutdown(application: Application):
+    if metrics_server is not None:
+        await metrics_server.close()
+    group_batcher.close()
+    await scheduler.stop()
+    await admin_data_writer.flush()
+    admin_data_writer.close()
+    await asyncio.to_thread(history_store.close)
+    await asyncio.to_thread(user_directory.close)
+    if cpu_pool:
+        cpu_pool.close()
+
+
 def main():
     load_admin_data()
     
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    
-    # Command handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("admin", admin))
-    application.add_handler(CommandHandler("status", status))
-    application.add_handler(CommandHandler("stop", stop_bot))
-    application.add_handler(CommandHandler("resume", resume_bot))
-    application.add_handler(CommandHandler("block", block_user))
-    application.add_handler(CommandHandler("unblock", unblock_user))
-    application.add_handler(CommandHandler("mute", mute_user))
-    application.add_handler(CommandHandler("unmute", unmute_user))
-    application.add_handler(CommandHandler("abuse", abuse_user))
-    application.add_handler(CommandHandler("unabuse", unabuse_user))
-    application.add_handler(CommandHandler("reset", reset_data))
-    application.add_handler(CommandHandler("restart", restart_bot))
-    application.add_handler(CommandHandler("groupon", group_on))
-    application.add_handler(CommandHandler("groupoff", group_off))
-    application.add_handler(CommandHandler("listblocked", list_blocked))
-    application.add_handler(CommandHandler("listmuted", list_muted))
-    application.add_handler(CommandHandler("listabuse", list_abuse))
-    application.add_handler(CommandHandler("addadmin", add_admin))
-    application.add_handler(CommandHandler("removeadmin", remove_admin))
-    application.add_handler(CommandHandler("listadmins", list_admins))
-    application.add_handler(CommandHandler("addlover", add_lover))
-    application.add_handler(CommandHandler("removelover", remove_lover))
-    application.add_handler(CommandHandler("listlovers", list_lovers))
-    application.add_handler(CommandHandler("blocknaughty", block_naughty))
-    application.add_handler(CommandHandler("unblocknaughty", unblock_naughty))
-    application.add_handler(CommandHandler("listblocknaughty", list_blocked_naughty))
-    application.add_handler(CommandHandler("joke", tell_joke))
-    application.add_handler(CommandHandler("quote", send_quote))
-    application.add_handler(CommandHandler("tip", daily_tip))
-    application.add_handler(CommandHandler("compliment", compliment_command))
-    application.add_handler(CommandHandler("fortune", fortune_command))
-    application.add_handler(CommandHandler("dare", dare_command))
-    application.add_handler(CommandHandler("truth", truth_command))
-    application.add_handler(CommandHandler("flip", flip_command))
-    application.add_handler(CommandHandler("dice", dice_command))
-    application.add_handler(CommandHandler("lovetest", love_test))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("myinfo", my_info))
-    application.add_handler(CommandHandler("viewchat", view_chat))
-    application.add_handler(CommandHandler("listusers", list_users))
-    application.add_handler(CommandHandler("broadcast", broadcast_message))
-    application.add_handler(CommandHandler("clear", clear_chat))
+    # Handlers await Gemini asynchronously, so let PTB run updates concurrently
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .request(InstrumentedRequest())
+        .rate_limiter(send_queue)
+        .concurrent_updates(True)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    
+    # Commands are routed through one dict lookup instead of a handler per command
+    commands = CommandRouter()
+    commands.add("start", start)
+    commands.add("admin", admin)
+    commands.add("status", status)
+    commands.add("stop", stop_bot)
+    commands.add("resume", resume_bot)
+    commands.add("block", block_user)
+    commands.add("unblock", unblock_user)
+    commands.add("mute", mute_user)
+    commands.add("unmute", unmute_user)
+    commands.add("abuse", abuse_user)
+    commands.add("unabuse", unabuse_user)
+    commands.add("reset", reset_data)
+    commands.add("restart", restart_bot)
+    commands.add("reloadkeywords", reload_keywords_command)
+    commands.add("groupon", group_on)
+    commands.add("groupoff", group_off)
+    commands.add("groupbudget", group_budget)
+    commands.add("listblocked", list_blocked)
+    commands.add("listmuted", list_muted)
+    commands.add("listabuse", list_abuse)
+    commands.add("addadmin", add_admin)
+    commands.add("removeadmin", remove_admin)
+    commands.add("listadmins", list_admins)
+    commands.add("addlover", add_lover)
+    commands.add("removelover", remove_lover)
+    commands.add("listlovers", list_lovers)
+    commands.add("blocknaughty", block_naughty)
+    commands.add("unblocknaughty", unblock_naughty)
+    commands.add("listblocknaughty", list_blocked_naughty)
+    commands.add("joke", tell_joke)
+    commands.add("quote", send_quote)
+    commands.add("tip", daily_tip)
+    commands.add("compliment", compliment_command)
+    commands.add("fortune", fortune_command)
+    commands.add("dare", dare_command)
+    commands.add("truth", truth_command)
+    commands.add("flip", flip_command)
+    commands.add("dice", dice_command)
+    commands.add("lovetest", love_test)
+    commands.add("help", help_command)
+    commands.add("myinfo", my_info)
+    commands.add("viewchat", view_chat)
+    commands.add("listusers", list_users)
+    commands.add("broadcast", broadcast_message)
+    commands.add("clear", clear_chat)
+    application.add_handler(TypeHandler(Update, attach_access), group=-2)
+    application.add_handler(commands)
+    application.add_handler(CallbackQueryHandler(handle_listing_callback, pattern=f"^{LIST_CALLBACK_PREFIX}:"))
     application.add_handler(CallbackQueryHandler(handle_permission_callback))
     application.add_handler(MessageHandler(filters.Sticker.ALL, handle_sticker))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    install_update_counters(application)
+    allowed_updates = allowed_updates_for(application)
     
     application.add_error_handler(error_handler)
     
-    # Setup keep-alive job to send message every 10 minutes (Render shuts down after 15 mins inactivity)
     job_queue = application.job_queue
-    job_queue.run_repeating(keep_alive_job, interval=600, first=60)  # Every 10 minutes, first run after 1 min
+    if not WEBHOOK_URL and not SHARD_INDEX:
+        # Polling has no inbound traffic, so ping the admin every 10 minutes (Render shuts down after 15 mins inactivity)
+        job_queue.run_repeating(keep_alive_job, interval=600, first=60)  # Every 10 minutes, first run after 1 min
+    if ADMIN_STORE == "sqlite":
+        job_queue.run_repeating(sync_admin_data_job, interval=ADMIN_SYNC_INTERVAL, first=ADMIN_SYNC_INTERVAL)
+    else:
+        job_queue.run_repeating(flush_admin_data_job, interval=ADMIN_DATA_FLUSH_INTERVAL, first=ADMIN_DATA_FLUSH_INTERVAL)
+    if history_store.durable:
+        job_queue.run_repeating(flush_history_job, interval=HISTORY_FLUSH_INTERVAL, first=HISTORY_FLUSH_INTERVAL)
+    job_queue.run_repeating(flush_user_directory_job, interval=HISTORY_FLUSH_INTERVAL, first=HISTORY_FLUSH_INTERVAL)
+    job_queue.run_repeating(evict_idle_history_job, interval=60, first=60)
+    job_queue.run_repeating(summarize_job, interval=SUMMARY_INTERVAL, first=SUMMARY_INTERVAL)
     
     logger.info("Naina Bot is running! Press Ctrl+C to stop.")
     print("✅ Naina Bot is running successfully!")
@@ -983,7 +1362,33 @@ def main():
     else:
         print("\n⚠️ Admin needs to /start the bot to receive permission requests")
     
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if SHARD_INDEX is not None:
+        # Worker: updates come from the front on a local port; the front owns the webhook
+        server = HttpServer("127.0.0.1", int(os.environ["SHARD_PORT"]))
+        server.route("POST", WORKER_UPDATE_PATH, make_webhook_handler(application, os.environ["SHARD_SECRET"]))
+        server.route("GET", "/health", serve_health)
+        asyncio.run(serve_webhook(application, server, None, None))
+    elif SHARD_COUNT > 1:
+        supervisor = WorkerSupervisor(SHARD_COUNT, SHARD_BASE_PORT, secrets.token_urlsafe(32))
+        front = ShardFront(supervisor.worker_urls(), supervisor.worker_secret)
+        server = None
+        if WEBHOOK_URL:
+            server = HttpServer("0.0.0.0", PORT)
+            server.route("POST", WEBHOOK_PATH, front.webhook_handler(WEBHOOK_SECRET))
+            server.route("GET", "/health", serve_health)
+        print(f"🧩 Front for {SHARD_COUNT} shards")
+        asyncio.run(serve_shard_front(application.bot, front, supervisor, server,
+                                      WEBHOOK_URL + WEBHOOK_PATH if WEBHOOK_URL else None, WEBHOOK_SECRET,
+                                      allowed_updates=allowed_updates))
+    elif WEBHOOK_URL:
+        server = HttpServer("0.0.0.0", PORT)
+        server.route("POST", WEBHOOK_PATH, make_webhook_handler(application, WEBHOOK_SECRET))
+        server.route("GET", "/health", serve_health)
+        print(f"🌐 Webhook mode on port {PORT}")
+        asyncio.run(serve_webhook(application, server, WEBHOOK_URL + WEBHOOK_PATH, WEBHOOK_SECRET,
+                                  allowed_updates=allowed_updates))
+    else:
+        application.run_polling(allowed_updates=allowed_updates)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,244 @@
+import time
+import bisect
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers a fast Telegram call up to a slow Gemini reply
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_text(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._children = {}
+        REGISTRY.append(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _matching(self, **labels):
+        for values, child in self._children.items():
+            label_map = dict(zip(self.label_names, values))
+            if all(label_map.get(name) == str(value) for name, value in labels.items()):
+                yield child
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def total(self, **labels) -> float:
+        """Sum over every child whose labels match"""
+        return sum(child.value for child in self._matching(**labels))
+
+    def render(self):
+        for values, child in self._children.items():
+            yield f"{self.name}_total{_label_text(self.label_names, values)} {child.value:g}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labels)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def summary(self, **labels) -> dict:
+        """count, average and bucket-estimated p50/p95 over every child whose labels match"""
+        counts = [0] * len(self.buckets)
+        count, total = 0, 0.0
+        for child in self._matching(**labels):
+            counts = [a + b for a, b in zip(counts, child.counts)]
+            count += child.count
+            total += child.sum
+        if not count:
+            return {"count": 0}
+        return {
+            "count": count,
+            "avg": total / count,
+            "p50": self._quantile(counts, count, 0.5),
+            "p95": self._quantile(counts, count, 0.95),
+        }
+
+    def _quantile(self, counts, count, q):
+        """Upper bound of the bucket holding the q-th observation; inf past the last bucket"""
+        rank, seen = q * count, 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def render(self):
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, child.counts):
+                cumulative += bucket_count
+                labels = _label_text(self.label_names + ("le",), values + (f"{bound:g}",))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _label_text(self.label_names + ("le",), values + ("+Inf",))
+            yield f"{self.name}_bucket{labels} {child.count}"
+            labels = _label_text(self.label_names, values)
+            yield f"{self.name}_sum{labels} {child.sum:.6f}"
+            yield f"{self.name}_count{labels} {child.count}"
+
+
+class Gauge:
+    """Read at scrape time from fn(), which returns a number or a {label_value: number} dict"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, fn, label: str = None):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+        self.label = label
+        REGISTRY.append(self)
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.error(f"Reading gauge {self.name} failed: {e}")
+            return
+        if isinstance(value, dict):
+            for label_value, number in value.items():
+                yield f"{self.name}{_label_text((self.label,), (label_value,))} {number:g}"
+        else:
+            yield f"{self.name} {value:g}"
+
+
+REGISTRY = []
+
+
+def render_metrics() -> str:
+    """Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+GEMINI_SECONDS = Histogram("naina_gemini_request_seconds", "Gemini request latency per attempt",
+                           ("persona", "key"))
+GEMINI_REQUESTS = Counter("naina_gemini_requests", "Gemini attempts by outcome (ok, error, empty)",
+                          ("persona", "key", "outcome"))
+GEMINI_FALLBACKS = Counter("naina_gemini_fallbacks", "Requests retried on another key after a failure",
+                           ("persona",))
+GEMINI_EMPTY = Counter("naina_gemini_empty_responses", "Requests that ended without reply text",
+                       ("persona",))
+UPDATE_SECONDS = Histogram("naina_update_handling_seconds", "Time spent in handle_message before queueing the reply",
+                           ("chat_type",))
+REPLY_SECONDS = Histogram("naina_reply_seconds", "Time from a reply job starting to the reply being sent",
+                          ("chat_type",))
+TELEGRAM_SECONDS = Histogram("naina_telegram_request_seconds", "Bot API call latency", ("method",))
+CLASSIFIER_HITS = Counter("naina_classifier_hits", "Messages matching each keyword category", ("category",))
+UPDATES = Counter("naina_updates", "Updates received, by update type", ("type",))
+UPDATES_UNHANDLED = Counter("naina_updates_unhandled", "Updates no handler acted on, by update type", ("type",))
+COMMANDS = Counter("naina_commands", "Commands dispatched, by command", ("command",))
+BROADCAST_MESSAGES = Counter("naina_broadcast_messages", "Broadcast sends by outcome", ("outcome",))
+OUTBOUND_MESSAGES = Counter("naina_outbound_messages", "Send queue calls by outcome (sent, merged, retried, failed)",
+                            ("outcome",))
+
+
+def _format_latency(summary: dict) -> str:
+    if not summary["count"]:
+        return "no data"
+    return (f"n={summary['count']} avg={summary['avg'] * 1000:.0f}ms "
+            f"p50≤{summary['p50'] * 1000:.0f}ms p95≤{summary['p95'] * 1000:.0f}ms")
+
+
+def status_summary() -> str:
+    """Short human-readable digest for /status"""
+    lines = [f"Gemini: {_format_latency(GEMINI_SECONDS.summary())}"]
+    for persona in sorted({values[0] for values in GEMINI_SECONDS._children}):
+        lines.append(f"  {persona}: {_format_latency(GEMINI_SECONDS.summary(persona=persona))}")
+    lines.append(f"Fallbacks: {GEMINI_FALLBACKS.total():g}, empty replies: {GEMINI_EMPTY.total():g}")
+    lines.append(f"Handling: {_format_latency(UPDATE_SECONDS.summary())}")
+    lines.append(f"Replies: {_format_latency(REPLY_SECONDS.summary())}")
+    lines.append(f"sendMessage: {_format_latency(TELEGRAM_SECONDS.summary(method='sendMessage'))}")
+    received = {values[0]: int(child.value) for values, child in UPDATES._children.items()}
+    unhandled = {values[0]: int(child.value) for values, child in UPDATES_UNHANDLED._children.items()}
+    lines.append(f"Updates: {received or 'none'}, unhandled: {unhandled or 'none'}")
+    hits = {values[0]: int(child.value) for values, child in CLASSIFIER_HITS._children.items()}
+    lines.append(f"Keyword hits: {hits or 'none'}")
+    broadcast = {values[0]: int(child.value) for values, child in BROADCAST_MESSAGES._children.items()}
+    if broadcast:
+        lines.append(f"Broadcast: {broadcast}")
+    return "\n".join(lines)
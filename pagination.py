@@ -0,0 +1,54 @@
+import os
+import time
+import heapq
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Callback data of the ◀️/▶️ buttons: "page:<listing>:<days>:<n|p>:<cursor>"
+CALLBACK_PREFIX = "page"
+PAGE_SIZE = int(os.environ.get("LIST_PAGE_SIZE", "25"))
+
+
+def keyset_page(keys, after=None, before=None, limit: int = PAGE_SIZE):
+    """The `limit` smallest keys after a cursor (or largest before one), in order, and
+    whether more lie beyond them in that direction.
+
+    A bounded heap picks the page, so paging a dict of n ids costs O(n log limit) without
+    sorting or copying the whole dict.
+    """
+    if before is not None:
+        picked = heapq.nlargest(limit + 1, (key for key in keys if key < before))
+        more = len(picked) > limit
+        return picked[:limit][::-1], more
+    picked = heapq.nsmallest(limit + 1, (key for key in keys if after is None or key > after))
+    return picked[:limit], len(picked) > limit
+
+
+def encode_cursor(listing: str, days: int, direction: str, cursor: str) -> str:
+    return f"{CALLBACK_PREFIX}:{listing}:{days}:{direction}:{cursor}"
+
+
+def decode_cursor(data: str):
+    """(listing, days, after, before) from a button's callback data"""
+    _, listing, days, direction, cursor = data.split(":", 4)
+    if direction == "p":
+        return listing, int(days), None, cursor
+    return listing, int(days), cursor, None
+
+
+def page_keyboard(listing: str, days: int, first: str, last: str, has_prev: bool, has_next: bool):
+    """◀️/▶️ buttons that fetch the page before `first` / after `last`, or None on a lone page"""
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("◀️ Prev", callback_data=encode_cursor(listing, days, "p", first)))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Next ▶️", callback_data=encode_cursor(listing, days, "n", last)))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+def format_age(timestamp: float) -> str:
+    seconds = max(0.0, time.time() - timestamp)
+    if seconds < 3600:
+        return f"{int(seconds // 60)}m ago"
+    if seconds < 86400:
+        return f"{int(seconds // 3600)}h ago"
+    return f"{int(seconds // 86400)}d ago"
@@ -0,0 +1,239 @@
+import os
+import json
+import asyncio
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def write_json_atomic(path: str, data):
+    """Write JSON to a temp file next to path, then rename it over path"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class DebouncedJsonWriter:
+    """Persists a JSON snapshot only when marked dirty, coalescing changes into one write per flush.
+
+    snapshot_fn runs on the caller's thread so the state is copied consistently; the
+    serialization and disk write happen in a worker thread.
+    """
+
+    def __init__(self, path: str, snapshot_fn):
+        self.path = path
+        self.snapshot_fn = snapshot_fn
+        self.dirty = False
+        self.writes = 0
+        self._lock = asyncio.Lock()
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        async with self._lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            data = self.snapshot_fn()
+            try:
+                await asyncio.to_thread(write_json_atomic, self.path, data)
+                self.writes += 1
+            except Exception as e:
+                self.dirty = True
+                logger.error(f"Error writing {self.path}: {e}")
+
+    def flush_sync(self):
+        """Write immediately on the current thread, for shutdown paths without a running loop"""
+        if not self.dirty:
+            return
+        self.dirty = False
+        try:
+            write_json_atomic(self.path, self.snapshot_fn())
+            self.writes += 1
+        except Exception as e:
+            self.dirty = True
+            logger.error(f"Error writing {self.path}: {e}")
+
+    def close(self):
+        pass
+
+
+def _flatten_state(data: dict) -> dict:
+    """{(section, item): (kind, json value)}: dicts and lists become one row per entry so
+    concurrent writers only conflict when they touch the same entry"""
+    rows = {}
+    for section, value in data.items():
+        if isinstance(value, dict):
+            for item, item_value in value.items():
+                rows[(section, str(item))] = ("dict", json.dumps(item_value))
+        elif isinstance(value, (list, set)):
+            for item in value:
+                rows[(section, str(item))] = ("set", "null")
+        else:
+            rows[(section, "")] = ("value", json.dumps(value))
+    return rows
+
+
+def _unflatten_state(rows: dict) -> dict:
+    data = {}
+    for (section, item), (kind, value) in rows.items():
+        if kind == "dict":
+            data.setdefault(section, {})[item] = json.loads(value)
+        elif kind == "set":
+            data.setdefault(section, []).append(item)
+        else:
+            data[section] = json.loads(value)
+    return data
+
+
+class SharedStateStore:
+    """Drop-in for DebouncedJsonWriter that keeps the snapshot in SQLite, shared by several
+    worker processes.
+
+    A flush writes only the entries that changed since this process last synced, so
+    workers merge each other's edits instead of overwriting whole files. Every write also
+    bumps a version row, so changed_elsewhere() reports admin edits made by other processes
+    (and nothing else sharing the database file), after which load() picks them up.
+    """
+
+    def __init__(self, path: str, snapshot_fn):
+        from history_store import open_database
+        self.path = path
+        self.snapshot_fn = snapshot_fn
+        self.dirty = False
+        self.writes = 0
+        self._synced = {}
+        self._lock = asyncio.Lock()
+        self._db_lock = threading.Lock()
+        self._conn = open_database(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS admin_state ("
+            "section TEXT NOT NULL, item TEXT NOT NULL, kind TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (section, item)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS admin_state_version (id INTEGER PRIMARY KEY CHECK (id = 0), "
+            "version INTEGER NOT NULL)"
+        )
+        self._conn.execute("INSERT OR IGNORE INTO admin_state_version (id, version) VALUES (0, 0)")
+        self._conn.commit()
+        self._version = self._read_version()
+
+    def _read_version(self) -> int:
+        return self._conn.execute("SELECT version FROM admin_state_version WHERE id = 0").fetchone()[0]
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def is_empty(self) -> bool:
+        with self._db_lock:
+            return self._conn.execute("SELECT 1 FROM admin_state LIMIT 1").fetchone() is None
+
+    def seed(self, data: dict) -> bool:
+        """Store data if the store is still empty, as one transaction so only one of several
+        starting workers seeds it; False if another got there first"""
+        rows = _flatten_state(data)
+        with self._db_lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            if self._conn.execute("SELECT 1 FROM admin_state LIMIT 1").fetchone() is not None:
+                return False
+            self._conn.executemany(
+                "INSERT INTO admin_state (section, item, kind, value) VALUES (?, ?, ?, ?)",
+                [(section, item, kind, value) for (section, item), (kind, value) in rows.items()])
+            self._conn.execute("UPDATE admin_state_version SET version = version + 1 WHERE id = 0")
+            version = self._read_version()
+        self._synced = rows
+        self._version = version
+        return True
+
+    def read(self):
+        """The stored rows and the version they belong to, without treating them as synced"""
+        with self._db_lock:
+            # Version first: a commit landing in between is then seen again on the next check
+            version = self._read_version()
+            rows = {(section, item): (kind, value) for section, item, kind, value
+                    in self._conn.execute("SELECT section, item, kind, value FROM admin_state")}
+        return rows, version
+
+    def accept(self, rows: dict, version: int) -> dict:
+        """Mark rows from read() as applied locally and return them as admin data.
+
+        Call only once they really are applied: the next flush diffs against them, and a
+        stored entry missing from the local snapshot is deleted as a local removal.
+        """
+        self._synced = rows
+        self._version = version
+        return _unflatten_state(rows)
+
+    def load(self) -> dict:
+        return self.accept(*self.read())
+
+    def changed_elsewhere(self) -> bool:
+        """True while other processes have saved admin data that hasn't been accepted"""
+        with self._db_lock:
+            return self._read_version() != self._version
+
+    def _write(self, data: dict):
+        rows = _flatten_state(data)
+        upserts = [(section, item, kind, value) for (section, item), (kind, value) in rows.items()
+                   if self._synced.get((section, item)) != (kind, value)]
+        deletes = [key for key in self._synced if key not in rows]
+        if not upserts and not deletes:
+            return
+        with self._db_lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            version = self._read_version()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO admin_state (section, item, kind, value) VALUES (?, ?, ?, ?)", upserts)
+            self._conn.executemany("DELETE FROM admin_state WHERE section = ? AND item = ?", deletes)
+            self._conn.execute("UPDATE admin_state_version SET version = version + 1 WHERE id = 0")
+        self._synced = rows
+        # Only our own bump is synced; if someone else wrote in between, still load theirs
+        if version == self._version:
+            self._version = version + 1
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        async with self._lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            data = self.snapshot_fn()
+            try:
+                await asyncio.to_thread(self._write, data)
+                self.writes += 1
+            except Exception as e:
+                self.dirty = True
+                logger.error(f"Error writing shared state to {self.path}: {e}")
+
+    def flush_sync(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        try:
+            self._write(self.snapshot_fn())
+            self.writes += 1
+        except Exception as e:
+            self.dirty = True
+            logger.error(f"Error writing shared state to {self.path}: {e}")
+
+    def close(self):
+        with self._db_lock:
+            self._conn.close()
@@ -0,0 +1,100 @@
+import os
+import re
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_REPEATS = re.compile(r"(\w)\1{2,}")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_message(text: str) -> str:
+    """'Hiii Naina!! 😊' and 'hi naina' normalize to the same key"""
+    text = _PUNCTUATION.sub(" ", text.lower())
+    text = _REPEATS.sub(r"\1", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def context_fingerprint(texts) -> str:
+    joined = "\n".join(normalize_message(text) for text in texts)
+    return hashlib.blake2b(joined.encode(), digest_size=8).hexdigest() if joined else ""
+
+
+class ResponseCache:
+    """TTL + LRU cache of replies to short, common messages, keyed by (persona, normalized message, context).
+
+    Each key collects up to `variety` different model replies before it starts serving hits,
+    and hits rotate through them so a group doesn't see the exact same line every time.
+    """
+
+    def __init__(self, max_entries: int = 2000, ttl: float = 1800, variety: int = 3, max_words: int = 6):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variety = max(1, variety)
+        self.max_words = max_words
+        self._entries = OrderedDict()
+        self.hits = {}
+        self.misses = {}
+        self.evictions = 0
+
+    def eligible(self, message: str) -> bool:
+        normalized = normalize_message(message)
+        return bool(normalized) and len(normalized.split()) <= self.max_words
+
+    def _key(self, persona: str, message: str, fingerprint: str):
+        return (persona, normalize_message(message), fingerprint)
+
+    def get(self, persona: str, message: str, fingerprint: str = ""):
+        key = self._key(persona, message, fingerprint)
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] > self.ttl:
+            del self._entries[key]
+            entry = None
+        if entry is None or len(entry[1]) < self.variety:
+            self.misses[persona] = self.misses.get(persona, 0) + 1
+            return None
+        self._entries.move_to_end(key)
+        replies = entry[1]
+        entry[2] = (entry[2] + 1) % len(replies)
+        self.hits[persona] = self.hits.get(persona, 0) + 1
+        return replies[entry[2]]
+
+    def put(self, persona: str, message: str, fingerprint: str, reply: str):
+        key = self._key(persona, message, fingerprint)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [time.monotonic(), [], 0]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._entries.move_to_end(key)
+        if reply not in entry[1] and len(entry[1]) < self.variety:
+            entry[1].append(reply)
+
+    def get_stats(self) -> dict:
+        personas = set(self.hits) | set(self.misses)
+        return {
+            "entries": len(self._entries),
+            "evictions": self.evictions,
+            "personas": {
+                persona: {"hits": self.hits.get(persona, 0), "misses": self.misses.get(persona, 0)}
+                for persona in sorted(personas)
+            },
+        }
+
+
+def create_response_cache():
+    """Opt-in via RESPONSE_CACHE=1; tuned with RESPONSE_CACHE_TTL, _SIZE, _VARIETY and _MAX_WORDS"""
+    if os.environ.get("RESPONSE_CACHE", "").lower() not in ("1", "true", "yes"):
+        return None
+    return ResponseCache(
+        max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", "2000")),
+        ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "1800")),
+        variety=int(os.environ.get("RESPONSE_CACHE_VARIETY", "3")),
+        max_words=int(os.environ.get("RESPONSE_CACHE_MAX_WORDS", "6")),
+    )
@@ -0,0 +1,96 @@
+import logging
+from telegram import Update, MessageEntity
+from telegram.ext import BaseHandler, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler
+from metrics import UPDATES, UPDATES_UNHANDLED, COMMANDS
+
+logger = logging.getLogger(__name__)
+
+
+class CommandRouter(BaseHandler):
+    """All /commands behind one handler: the command name is looked up in a dict
+    instead of PTB testing one CommandHandler after another"""
+
+    def __init__(self):
+        super().__init__(self.dispatch)
+        self.commands = {}
+
+    def add(self, command: str, callback):
+        self.commands[command.lower()] = callback
+
+    def _command(self, message):
+        """The routed command a message starts with (lowercased), or None"""
+        if message is None or not message.text or not message.entities:
+            return None
+        entity = message.entities[0]
+        if entity.type != MessageEntity.BOT_COMMAND or entity.offset != 0:
+            return None
+        command, _, target = message.text[1:entity.length].partition("@")
+        if target and target.lower() != (message.get_bot().username or "").lower():
+            return None
+        command = command.lower()
+        return command if command in self.commands else None
+
+    def check_update(self, update):
+        if not isinstance(update, Update):
+            return None
+        command = self._command(update.message)
+        if command is None:
+            return None
+        return command, update.message.text.split()[1:]
+
+    def collect_additional_context(self, context, update, application, check_result):
+        context.args = check_result[1]
+
+    async def dispatch(self, update, context):
+        """The handler callback: run the command check_update matched"""
+        command = self._command(update.message)
+        COMMANDS.labels(command).inc()
+        return await self.commands[command](update, context)
+
+
+# Update types each handler class can act on. Every callback in this bot reads
+# update.message, so edits and channel posts would only be downloaded to be dropped.
+HANDLER_UPDATE_TYPES = {
+    CommandRouter: (Update.MESSAGE,),
+    CommandHandler: (Update.MESSAGE,),
+    MessageHandler: (Update.MESSAGE,),
+    CallbackQueryHandler: (Update.CALLBACK_QUERY,),
+}
+
+
+def update_type(update: Update) -> str:
+    for kind in Update.ALL_TYPES:
+        if getattr(update, kind, None) is not None:
+            return kind
+    return "unknown"
+
+
+async def count_update(update, context):
+    UPDATES.labels(update_type(update)).inc()
+
+
+async def count_unhandled(update, context):
+    UPDATES_UNHANDLED.labels(update_type(update)).inc()
+
+
+def install_update_counters(application):
+    """Count every update before dispatch, and the ones no handler in group 0 took.
+    Call after all handlers are added so the catch-all sits last in group 0."""
+    application.add_handler(TypeHandler(Update, count_update), group=-1)
+    application.add_handler(TypeHandler(Update, count_unhandled))
+
+
+def allowed_updates_for(application) -> list:
+    """The update types the registered handlers can use, for getUpdates/setWebhook;
+    falls back to every type if a handler's needs aren't known"""
+    allowed = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, TypeHandler):
+                continue
+            types = HANDLER_UPDATE_TYPES.get(type(handler))
+            if types is None:
+                logger.warning(f"No known update types for {type(handler).__name__}, subscribing to all")
+                return list(Update.ALL_TYPES)
+            allowed.update(types)
+    return sorted(allowed)
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class ChatScheduler:
+    """Runs queued jobs in FIFO order per chat, serving chats round-robin with a bounded worker pool.
+
+    Each chat has its own queue and at most one job in flight, so replies in a chat keep
+    their order. A chat that still has work after a job is put at the back of the ready
+    queue, which stops one busy group from starving everyone else.
+    """
+
+    def __init__(self, max_workers: int = 8, max_pending_per_chat: int = 50):
+        self.max_workers = max_workers
+        self.max_pending_per_chat = max_pending_per_chat
+        self._queues = {}
+        self._scheduled = set()
+        self._ready = None
+        self._workers = []
+        self.pending = 0
+        self.running = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    def start(self):
+        if self._workers:
+            return
+        self._ready = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+        logger.info(f"Chat scheduler started with {self.max_workers} workers")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, chat_id: str, job) -> bool:
+        """Queue job (a no-argument coroutine function) behind the chat's pending work"""
+        self.start()
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+        if len(queue) >= self.max_pending_per_chat:
+            self.dropped += 1
+            logger.warning(f"Chat {chat_id} has {len(queue)} pending jobs, dropping new one")
+            return False
+        queue.append((time.monotonic(), job))
+        self.pending += 1
+        if chat_id not in self._scheduled:
+            self._scheduled.add(chat_id)
+            self._ready.put_nowait(chat_id)
+        return True
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            queue = self._queues[chat_id]
+            enqueued_at, job = queue.popleft()
+            self.pending -= 1
+
+            wait = time.monotonic() - enqueued_at
+            self.total_wait += wait
+            self.last_wait = wait
+            self.max_wait = max(self.max_wait, wait)
+
+            self.running += 1
+            try:
+                await job()
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Scheduled job for chat {chat_id} failed: {e}")
+            finally:
+                self.running -= 1
+
+            if queue:
+                self._ready.put_nowait(chat_id)
+            else:
+                del self._queues[chat_id]
+                self._scheduled.discard(chat_id)
+
+    def get_metrics(self) -> dict:
+        completed = self.processed + self.failed
+        return {
+            "workers": self.max_workers,
+            "queued_chats": len(self._queues),
+            "queue_depth": self.pending,
+            "max_chat_queue_depth": max((len(q) for q in self._queues.values()), default=0),
+            "running": self.running,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "avg_wait_ms": round(self.total_wait / completed * 1000, 1) if completed else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "last_wait_ms": round(self.last_wait * 1000, 1),
+        }
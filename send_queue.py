@@ -0,0 +1,269 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+from collections import deque
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from rate_limit import TokenBucket, retry_after_seconds
+from metrics import OUTBOUND_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+# Lower goes first. Callers can pass rate_limit_args={"priority": ...} to override the
+# priority taken from the chat, and {"merge": False} for a message they will edit later.
+PRIORITY_ADMIN = 0
+PRIORITY_PRIVATE = 1
+PRIORITY_GROUP = 2
+PRIORITY_BULK = 3
+
+MAX_MESSAGE_LENGTH = 4096
+# Only plain sendMessage calls are merged; anything with a keyboard, reply or parse mode goes as is
+MERGEABLE_FIELDS = {"chat_id", "text"}
+
+
+class _Send:
+    __slots__ = ("priority", "merge", "seq", "chat_id", "endpoint", "data", "callback", "args", "kwargs",
+                 "futures", "attempts")
+
+    def __init__(self, priority, merge, seq, chat_id, endpoint, data, callback, args, kwargs, future):
+        self.priority = priority
+        self.merge = merge
+        self.seq = seq
+        self.chat_id = chat_id
+        self.endpoint = endpoint
+        self.data = data
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.futures = [future]
+        self.attempts = 0
+
+    @property
+    def mergeable(self) -> bool:
+        return self.merge and self.endpoint == "sendMessage" and self.data.keys() <= MERGEABLE_FIELDS
+
+    def absorb(self, other) -> bool:
+        """Append other's text to this message if both are plain and it still fits"""
+        if not (self.mergeable and other.mergeable):
+            return False
+        text = f"{self.data['text']}\n\n{other.data['text']}"
+        if len(text) > MAX_MESSAGE_LENGTH:
+            return False
+        self.data["text"] = text
+        self.futures.extend(other.futures)
+        return True
+
+
+class SendQueue(BaseRateLimiter):
+    """Every Bot API call that targets a chat waits here for a per-chat token and a global one.
+
+    Chats take turns by priority (admins, then private chats, then groups, then broadcasts)
+    and each chat has one call in flight at a time, so its messages keep their order. When
+    a chat backs up, plain text messages queued behind each other go out as one message.
+    A RetryAfter pauses the chat (and everyone, if it came from a private chat, where only
+    the global limit can be the cause) and puts the call back at the head of its chat.
+    Calls without a chat_id (getMe, answerCallbackQuery, setWebhook ...) skip the queue.
+    """
+
+    def __init__(self, rate: float = 30.0, private_rate: float = 1.0, group_per_minute: float = 20.0,
+                 max_retries: int = 3, urgent_chat=None):
+        self.rate = rate
+        self.private_rate = private_rate
+        self.group_rate = group_per_minute / 60
+        self.max_retries = max_retries
+        self.urgent_chat = urgent_chat
+        # A bucket lets capacity + rate calls through in any one second, so keep the burst small
+        self.global_bucket = TokenBucket(rate, capacity=max(1.0, rate / 10))
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+        self.failed = 0
+        self._buckets = {}
+        self._queues = {}
+        self._in_flight = set()
+        self._ready = []    # (priority, seq, chat_id) of chats whose next call may go now
+        self._waiting = []  # (monotonic time, chat_id) of chats out of tokens until then
+        self._seq = 0
+        self._wakeup = None
+        self._dispatcher = None
+        self._tasks = set()
+
+    async def initialize(self):
+        if self._dispatcher is None:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is None:
+            return
+        # Give queued replies a moment to go out before the HTTP client closes
+        deadline = time.monotonic() + 5
+        while (self._queues or self._tasks) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._dispatcher.cancel()
+        await asyncio.gather(self._dispatcher, *self._tasks, return_exceptions=True)
+        self._dispatcher = None
+        for queue in self._queues.values():
+            for item in queue:
+                for future in item.futures:
+                    if not future.done():
+                        future.cancel()
+        self._queues.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None or self._dispatcher is None:
+            return await callback(*args, **kwargs)
+        chat_id = str(chat_id)
+        options = rate_limit_args or {}
+        priority = options.get("priority")
+        if priority is None:
+            if self.urgent_chat and self.urgent_chat(chat_id):
+                priority = PRIORITY_ADMIN
+            else:
+                priority = PRIORITY_GROUP if chat_id.startswith("-") else PRIORITY_PRIVATE
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        item = _Send(priority, options.get("merge", True), self._seq, chat_id, endpoint, data,
+                     callback, args, kwargs, future)
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+        queue.append(item)
+        if len(queue) == 1 and chat_id not in self._in_flight:
+            self._mark_ready(chat_id)
+        return await future
+
+    def _bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= 10000:
+                self._prune_buckets()
+            rate = self.group_rate if chat_id.startswith("-") else self.private_rate
+            bucket = TokenBucket(rate, capacity=3)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_buckets(self):
+        """Forget buckets that have refilled; a new one starts full, which is the same thing"""
+        now = time.monotonic()
+        for chat_id, bucket in list(self._buckets.items()):
+            full_at = bucket.updated_at + (bucket.capacity - bucket.tokens) / bucket.rate
+            if full_at <= now and bucket.paused_until <= now and chat_id not in self._queues:
+                del self._buckets[chat_id]
+
+    def _mark_ready(self, chat_id: str):
+        head = self._queues[chat_id][0]
+        heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        self._wakeup.set()
+
+    def _next(self):
+        """Pop the most urgent chat that has a token, or return None and how long to wait"""
+        now = time.monotonic()
+        while self._waiting and self._waiting[0][0] <= now:
+            _, chat_id = heapq.heappop(self._waiting)
+            if chat_id in self._queues and chat_id not in self._in_flight:
+                self._mark_ready(chat_id)
+        while self._ready:
+            _, seq, chat_id = heapq.heappop(self._ready)
+            queue = self._queues.get(chat_id)
+            if not queue or queue[0].seq != seq or chat_id in self._in_flight:
+                continue
+            bucket = self._bucket(chat_id)
+            if not bucket.try_acquire():
+                heapq.heappush(self._waiting, (now + bucket.delay(), chat_id))
+                continue
+            return chat_id, None
+        return None, (self._waiting[0][0] - now if self._waiting else None)
+
+    async def _dispatch(self):
+        while True:
+            chat_id, wait = self._next()
+            if chat_id is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.global_bucket.acquire()
+            queue = self._queues[chat_id]
+            item = queue.popleft()
+            # The chat fell behind its limit: send what piled up as one message
+            while queue and item.absorb(queue[0]):
+                queue.popleft()
+                self.merged += 1
+                OUTBOUND_MESSAGES.labels("merged").inc()
+            if not queue:
+                del self._queues[chat_id]
+            self._in_flight.add(chat_id)
+            task = asyncio.create_task(self._send(item))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, item: _Send):
+        try:
+            result = await item.callback(*item.args, **item.kwargs)
+        except RetryAfter as e:
+            seconds = retry_after_seconds(e)
+            item.attempts += 1
+            self._bucket(item.chat_id).pause(seconds)
+            if not item.chat_id.startswith("-"):
+                self.global_bucket.pause(seconds)
+            if item.attempts <= self.max_retries:
+                self.retried += 1
+                OUTBOUND_MESSAGES.labels("retried").inc()
+                logger.warning(f"Flood limit in chat {item.chat_id}, retrying in {seconds:g}s")
+                self._queues.setdefault(item.chat_id, deque()).appendleft(item)
+                return
+            self._fail(item, e)
+        except Exception as e:
+            self._fail(item, e)
+        else:
+            self.sent += 1
+            OUTBOUND_MESSAGES.labels("sent").inc()
+            for future in item.futures:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._in_flight.discard(item.chat_id)
+            if item.chat_id in self._queues:
+                self._mark_ready(item.chat_id)
+
+    def _fail(self, item: _Send, error: Exception):
+        self.failed += 1
+        OUTBOUND_MESSAGES.labels("failed").inc()
+        for future in item.futures:
+            if not future.done():
+                future.set_exception(error)
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def get_stats(self) -> dict:
+        return {
+            "queued": self.depth,
+            "chats": len(self._queues),
+            "sent": self.sent,
+            "merged": self.merged,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+def create_send_queue(urgent_chat=None, shards: int = 1) -> SendQueue:
+    """Limits from SEND_RATE (messages/s overall), SEND_PRIVATE_RATE (per private chat, /s)
+    and SEND_GROUP_PER_MINUTE; Telegram's documented ceilings are 30, 1 and 20.
+
+    SEND_RATE is for the whole bot, so each of `shards` worker processes gets an equal share.
+    Per-chat limits need no split: every chat is served by one shard.
+    """
+    return SendQueue(
+        rate=float(os.environ.get("SEND_RATE", "30")) / max(1, shards),
+        private_rate=float(os.environ.get("SEND_PRIVATE_RATE", "1")),
+        group_per_minute=float(os.environ.get("SEND_GROUP_PER_MINUTE", "20")),
+        urgent_chat=urgent_chat,
+    )
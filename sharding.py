@@ -0,0 +1,205 @@
+import os
+import sys
+import hmac
+import json
+import signal
+import asyncio
+import logging
+import httpx
+from http_server import HttpResponse
+from webhook import SECRET_HEADER
+
+logger = logging.getLogger(__name__)
+
+WORKER_UPDATE_PATH = "/update"
+FORWARD_TIMEOUT = 10.0
+MAX_RESTART_DELAY = 60.0
+
+# Update payloads that carry the chat they belong to, checked in this order
+_CHAT_SOURCES = ("message", "edited_message", "channel_post", "edited_channel_post",
+                 "my_chat_member", "chat_member", "chat_join_request", "message_reaction")
+
+
+def shard_for(chat_id: int, shard_count: int) -> int:
+    return abs(int(chat_id)) % shard_count
+
+
+def update_chat_id(data: dict) -> int:
+    """The chat an update belongs to, read from the raw JSON without building an Update;
+    updates without a chat (inline queries, polls) go by their sender, else to shard 0"""
+    for source in _CHAT_SOURCES:
+        payload = data.get(source)
+        if payload and "chat" in payload:
+            return payload["chat"]["id"]
+    callback_query = data.get("callback_query")
+    if callback_query:
+        message = callback_query.get("message") or {}
+        if "chat" in message:
+            return message["chat"]["id"]
+        return callback_query["from"]["id"]
+    for payload in data.values():
+        if isinstance(payload, dict) and "from" in payload:
+            return payload["from"]["id"]
+    return 0
+
+
+class ShardFront:
+    """Receives every update once and hands it to the worker that owns its chat"""
+
+    def __init__(self, worker_urls: list, worker_secret: str):
+        self.worker_urls = worker_urls
+        self.worker_secret = worker_secret
+        self.forwarded = [0] * len(worker_urls)
+        self.failed = 0
+        self._client = httpx.AsyncClient(timeout=FORWARD_TIMEOUT)
+
+    async def forward(self, data: dict, body: bytes = None) -> bool:
+        shard = shard_for(update_chat_id(data), len(self.worker_urls))
+        try:
+            response = await self._client.post(
+                self.worker_urls[shard],
+                content=body if body is not None else json.dumps(data).encode(),
+                headers={SECRET_HEADER: self.worker_secret, "Content-Type": "application/json"},
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            self.failed += 1
+            logger.error(f"Forwarding update {data.get('update_id')} to shard {shard} failed: {e}")
+            return False
+        self.forwarded[shard] += 1
+        return True
+
+    def webhook_handler(self, secret: str):
+        """POST handler for Telegram's webhook; a 503 makes Telegram retry while a worker is down"""
+        async def handle(request):
+            if not hmac.compare_digest(request.headers.get(SECRET_HEADER, "").encode(), secret.encode()):
+                return HttpResponse(403, "Forbidden")
+            try:
+                data = json.loads(request.body)
+            except ValueError:
+                return HttpResponse(400, "Invalid JSON")
+            if await self.forward(data, request.body):
+                return HttpResponse(200, "ok")
+            return HttpResponse(503, "Worker unavailable")
+        return handle
+
+    async def poll(self, bot, allowed_updates=None):
+        """Long-poll getUpdates and forward, keeping each shard's updates in order"""
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+            except Exception as e:
+                logger.error(f"getUpdates failed: {e}")
+                await asyncio.sleep(5)
+                continue
+            by_shard = {}
+            for update in updates:
+                data = update.to_dict()
+                by_shard.setdefault(shard_for(update_chat_id(data), len(self.worker_urls)), []).append(data)
+                offset = update.update_id + 1
+
+            async def forward_in_order(batch):
+                for data in batch:
+                    for attempt in range(3):
+                        if await self.forward(data):
+                            break
+                        await asyncio.sleep(2 ** attempt)
+
+            await asyncio.gather(*(forward_in_order(batch) for batch in by_shard.values()))
+
+    async def close(self):
+        await self._client.aclose()
+
+    def get_stats(self) -> dict:
+        return {"forwarded": list(self.forwarded), "failed": self.failed}
+
+
+class WorkerSupervisor:
+    """Runs `python main.py` once per shard with SHARD_INDEX/SHARD_COUNT/SHARD_PORT set,
+    restarting any worker that exits until stop() is called"""
+
+    def __init__(self, shard_count: int, base_port: int, worker_secret: str, script: str = "main.py"):
+        self.shard_count = shard_count
+        self.base_port = base_port
+        self.worker_secret = worker_secret
+        self.script = script
+        self.restarts = 0
+        self._processes = {}
+        self._tasks = []
+        self._stopping = False
+
+    def worker_urls(self) -> list:
+        return [f"http://127.0.0.1:{self.base_port + index}{WORKER_UPDATE_PATH}" for index in range(self.shard_count)]
+
+    async def _spawn(self, index: int):
+        env = dict(os.environ, SHARD_INDEX=str(index), SHARD_COUNT=str(self.shard_count),
+                   SHARD_PORT=str(self.base_port + index), SHARD_SECRET=self.worker_secret)
+        process = await asyncio.create_subprocess_exec(sys.executable, self.script, env=env)
+        self._processes[index] = process
+        logger.info(f"Started shard {index}/{self.shard_count} (pid {process.pid})")
+        return process
+
+    async def _keep_running(self, index: int):
+        delay = 1.0
+        while not self._stopping:
+            process = await self._spawn(index)
+            code = await process.wait()
+            if self._stopping:
+                return
+            self.restarts += 1
+            logger.error(f"Shard {index} exited with code {code}, restarting in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._keep_running(index)) for index in range(self.shard_count)]
+
+    async def stop(self, timeout: float = 15.0):
+        """SIGTERM every worker so it flushes its state, then kill any that hang"""
+        self._stopping = True
+        processes = [process for process in self._processes.values() if process.returncode is None]
+        for process in processes:
+            process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(asyncio.gather(*(process.wait() for process in processes)), timeout)
+        except asyncio.TimeoutError:
+            for process in processes:
+                if process.returncode is None:
+                    process.kill()
+        for task in self._tasks:
+            task.cancel()
+
+
+async def serve_shard_front(bot, front: ShardFront, supervisor: WorkerSupervisor, server=None,
+                            webhook_url: str = None, secret: str = None, allowed_updates=None):
+    """Run the front and its workers until SIGINT/SIGTERM. With a webhook URL, updates
+    arrive on `server`; otherwise the front long-polls Telegram itself."""
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stopping.set)
+        except NotImplementedError:
+            pass
+
+    supervisor.start()
+    poller = None
+    async with bot:
+        try:
+            if webhook_url:
+                await server.start()
+                await bot.set_webhook(url=webhook_url, secret_token=secret, allowed_updates=allowed_updates)
+                logger.info(f"Webhook set to {webhook_url}, fanning out to {supervisor.shard_count} shards")
+            else:
+                await bot.delete_webhook()
+                poller = asyncio.create_task(front.poll(bot, allowed_updates))
+                logger.info(f"Polling for {supervisor.shard_count} shards")
+            await stopping.wait()
+        finally:
+            if poller:
+                poller.cancel()
+            if server:
+                await server.close()
+            await supervisor.stop()
+            await front.close()
@@ -0,0 +1,72 @@
+import time
+import asyncio
+import logging
+from telegram.error import BadRequest, RetryAfter
+from rate_limit import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# Telegram tolerates roughly one edit per second in a private chat and about
+# 20 messages (edits included) per minute in a group
+PRIVATE_EDIT_INTERVAL = 1.0
+GROUP_EDIT_INTERVAL = 3.0
+
+
+class StreamingReply:
+    """Shows a reply while it streams: sends the first chunk, then edits the message at a throttled rate"""
+
+    def __init__(self, bot, chat_id: int, edit_interval: float = PRIVATE_EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.edit_interval = edit_interval
+        self.message = None
+        self.shown_text = ""
+        self.next_edit_at = 0.0
+        self.edits = 0
+        # The first chunk is edited afterwards, so the send queue must not merge it with other replies
+        self._send_kwargs = {"rate_limit_args": {"merge": False}} if getattr(bot, "rate_limiter", None) else {}
+
+    async def update(self, text: str):
+        """on_partial callback; never raises so a Telegram hiccup can't abort the Gemini stream"""
+        if not text.strip():
+            return
+        if self.message is None:
+            await self._send(text)
+        elif time.monotonic() >= self.next_edit_at:
+            await self._edit(text)
+
+    async def finish(self, text: str):
+        """Make sure the final text is what the user ends up seeing"""
+        if self.message is None:
+            await self.bot.send_message(chat_id=self.chat_id, text=text)
+        elif text != self.shown_text:
+            try:
+                await self.message.edit_text(text)
+            except RetryAfter as e:
+                await asyncio.sleep(retry_after_seconds(e))
+                await self.message.edit_text(text)
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+
+    async def _send(self, text: str):
+        try:
+            self.message = await self.bot.send_message(chat_id=self.chat_id, text=text, **self._send_kwargs)
+            self.shown_text = text
+            self.next_edit_at = time.monotonic() + self.edit_interval
+        except Exception as e:
+            logger.error(f"Failed to send first streamed chunk to {self.chat_id}: {e}")
+
+    async def _edit(self, text: str):
+        try:
+            await self.message.edit_text(text)
+            self.shown_text = text
+            self.edits += 1
+            self.next_edit_at = time.monotonic() + self.edit_interval
+        except RetryAfter as e:
+            self.next_edit_at = time.monotonic() + retry_after_seconds(e)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                logger.error(f"Failed to edit streamed reply in {self.chat_id}: {e}")
+        except Exception as e:
+            logger.error(f"Failed to edit streamed reply in {self.chat_id}: {e}")
@@ -0,0 +1,63 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Per-turn framing overhead (role markers, separators) in the request
+TURN_OVERHEAD_TOKENS = 4
+
+# History tokens each persona may send per request; override with
+# CONTEXT_TOKEN_BUDGETS="group=3000,private=2000"
+DEFAULT_CONTEXT_TOKEN_BUDGETS = {
+    "private": 2000,
+    "lover": 2000,
+    "dirty": 1500,
+    "group": 3000,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate: ~4 ASCII chars per token, with Devanagari and emoji
+    (multi-byte in UTF-8) counted heavier since they tokenize into more pieces"""
+    extra_bytes = len(text.encode("utf-8")) - len(text)
+    return len(text) // 4 + extra_bytes // 2 + TURN_OVERHEAD_TOKENS
+
+
+def load_context_budgets() -> dict:
+    budgets = dict(DEFAULT_CONTEXT_TOKEN_BUDGETS)
+    for item in os.environ.get("CONTEXT_TOKEN_BUDGETS", "").split(","):
+        if "=" not in item:
+            continue
+        persona, value = item.split("=", 1)
+        try:
+            budgets[persona.strip()] = int(value)
+        except ValueError:
+            logger.error(f"Ignoring invalid context budget {item!r}")
+    return budgets
+
+
+class PromptTokenStats:
+    """Estimated prompt size per persona, for get_stats()"""
+
+    def __init__(self):
+        self._stats = {}
+
+    def record(self, persona: str, tokens: int):
+        stats = self._stats.get(persona)
+        if stats is None:
+            stats = self._stats[persona] = {"requests": 0, "total": 0, "last": 0, "max": 0}
+        stats["requests"] += 1
+        stats["total"] += tokens
+        stats["last"] = tokens
+        stats["max"] = max(stats["max"], tokens)
+        logger.debug(f"{persona} prompt ~{tokens} tokens")
+
+    def get_stats(self) -> dict:
+        return {
+            persona: {
+                "avg": stats["total"] // stats["requests"],
+                "last": stats["last"],
+                "max": stats["max"],
+            }
+            for persona, stats in self._stats.items()
+        }
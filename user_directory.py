@@ -0,0 +1,347 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from history_store import open_database, DEFAULT_HISTORY_DB_FILE
+
+logger = logging.getLogger(__name__)
+
+
+class UserDirectory:
+    """Every user the bot has seen: username, first name, first/last seen and the chats
+    they were seen in, kept in SQLite so /block @name keeps working after a restart.
+
+    touch() runs on every message and only touches memory: a write is queued when the
+    username or name changes, the user is new to this process, or last_seen (per user and
+    per chat) is more than last_seen_resolution seconds stale. flush() writes the queue in
+    one transaction, off the event loop, and only then drops it. Reads never flush: they
+    query a second connection and lay the queued rows over the result. Username lookups
+    hit an in-memory map first and fall back to an indexed query; admin listings page
+    through the tables by key instead of loading them.
+    """
+
+    def __init__(self, path: str, max_cached: int = 50000, last_seen_resolution: float = 300.0):
+        self.path = path
+        self.max_cached = max_cached
+        self.last_seen_resolution = last_seen_resolution
+        self._conn = open_database(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id TEXT PRIMARY KEY, username TEXT, first_name TEXT, "
+            "first_seen REAL NOT NULL, last_seen REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS users_by_username ON users (username, last_seen)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_chats ("
+            "user_id TEXT NOT NULL, chat_id TEXT NOT NULL, last_seen REAL NOT NULL, "
+            "PRIMARY KEY (user_id, chat_id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS user_chats_by_chat ON user_chats (chat_id, last_seen)")
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+        self._reader = open_database(path)
+        self._read_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        # Queued rows by key; a flush drops a row only if it is still the one it wrote
+        self._pending_users = {}
+        self._pending_chats = {}
+        self._pending_forgets = {}
+        # user_id -> [username, first_name, last_seen written, {chat_id: last_seen written}]
+        self._users = OrderedDict()
+        self._by_username = {}
+
+    def touch(self, user_id, username: str = None, first_name: str = None, chat_id=None):
+        now = time.time()
+        user_id = str(user_id)
+        username = username.lower() if username else None
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = self._users[user_id] = [None, None, 0.0, {}]
+            if len(self._users) > self.max_cached:
+                self._forget_oldest()
+        else:
+            self._users.move_to_end(user_id)
+
+        if entry[0] != username:
+            if entry[0] and self._by_username.get(entry[0]) == user_id:
+                del self._by_username[entry[0]]
+            if username:
+                self._by_username[username] = user_id
+        if entry[0] != username or entry[1] != first_name or now - entry[2] >= self.last_seen_resolution:
+            entry[0], entry[1], entry[2] = username, first_name, now
+            with self._pending_lock:
+                self._pending_users[user_id] = (user_id, username, first_name, now, now)
+
+        if chat_id is not None:
+            chat_id = str(chat_id)
+            if now - entry[3].get(chat_id, 0.0) >= self.last_seen_resolution:
+                entry[3][chat_id] = now
+                with self._pending_lock:
+                    self._pending_chats[(user_id, chat_id)] = (user_id, chat_id, now)
+                    self._pending_forgets.pop(user_id, None)
+
+    def forget_private_chat(self, user_id):
+        """Drop the user's private chat, e.g. after they blocked the bot, so private_chat_ids()
+        stops listing it; their next private message adds it back"""
+        user_id = str(user_id)
+        entry = self._users.get(user_id)
+        if entry is not None:
+            entry[3].pop(user_id, None)
+        with self._pending_lock:
+            self._pending_chats.pop((user_id, user_id), None)
+            self._pending_forgets[user_id] = (user_id, user_id)
+
+    def _forget_oldest(self):
+        user_id, entry = self._users.popitem(last=False)
+        if entry[0] and self._by_username.get(entry[0]) == user_id:
+            del self._by_username[entry[0]]
+
+    def _pending_view(self):
+        """Copies of the queued users, chat rows and forgotten private chats"""
+        with self._pending_lock:
+            return dict(self._pending_users), dict(self._pending_chats), set(self._pending_forgets)
+
+    def _select_in(self, sql: str, ids: list, params: tuple = ()) -> set:
+        """First column of sql run over ids in chunks; sql has {} where the IN list goes"""
+        found = set()
+        with self._read_lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                found.update(row[0] for row in self._reader.execute(
+                    sql.format(", ".join("?" * len(chunk))), (*chunk, *params)))
+        return found
+
+    def resolve(self, username: str):
+        """user_id for a username (without @), or None if it was never seen"""
+        username = username.lstrip("@").strip().lower()
+        user_id = self._by_username.get(username)
+        if user_id is not None:
+            return user_id
+        users, _, _ = self._pending_view()
+        queued = [row for row in users.values() if row[1] == username]
+        if queued:
+            user_id = max(queued, key=lambda row: row[4])[0]
+        else:
+            with self._read_lock:
+                rows = self._reader.execute(
+                    "SELECT user_id FROM users WHERE username = ? ORDER BY last_seen DESC", (username,))
+                # A queued row for the same user means they have been renamed since
+                user_id = next((user_id for (user_id,) in rows if user_id not in users), None)
+            if user_id is None:
+                return None
+        self._by_username[username] = user_id
+        return user_id
+
+    def describe(self, user_id) -> dict:
+        """Stored details for one user, or None"""
+        user_id = str(user_id)
+        users, chats, forgets = self._pending_view()
+        with self._read_lock:
+            row = self._reader.execute(
+                "SELECT username, first_name, first_seen, last_seen FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            seen = dict(self._reader.execute("SELECT chat_id, last_seen FROM user_chats WHERE user_id = ?", (user_id,)))
+        queued = users.get(user_id)
+        if queued is not None:
+            row = (queued[1], queued[2], row[2] if row else queued[3], queued[4])
+        if row is None:
+            return None
+        if user_id in forgets:
+            seen.pop(user_id, None)
+        seen.update((chat_id, last_seen) for (chat_user, chat_id), (_, _, last_seen) in chats.items()
+                    if chat_user == user_id)
+        return {"user_id": user_id, "username": row[0], "first_name": row[1],
+                "first_seen": row[2], "last_seen": row[3], "chats": sorted(seen, key=seen.get, reverse=True)}
+
+    def labels(self, user_ids) -> dict:
+        """user_id -> "@username (first name)" for the given ids that have been seen"""
+        labels = {}
+        missing = []
+        for user_id in map(str, user_ids):
+            entry = self._users.get(user_id)
+            if entry is None:
+                missing.append(user_id)
+            else:
+                labels[user_id] = user_label(entry[0], entry[1])
+        if missing:
+            users, _, _ = self._pending_view()
+            for user_id in missing:
+                if user_id in users:
+                    labels[user_id] = user_label(users[user_id][1], users[user_id][2])
+            missing = [user_id for user_id in missing if user_id not in users]
+        if missing:
+            with self._read_lock:
+                rows = self._reader.execute(
+                    f"SELECT user_id, username, first_name FROM users WHERE user_id IN ({', '.join('?' * len(missing))})",
+                    missing).fetchall()
+            for user_id, username, first_name in rows:
+                labels[user_id] = user_label(username, first_name)
+        return labels
+
+    def page_users(self, after=None, before=None, limit: int = 25, since: float = 0.0):
+        """Users seen since `since`, ordered by user_id: the page after or before a cursor.
+
+        Returns ([(user_id, username, first_name, last_seen), ...], more) where more says
+        whether anything lies beyond the page in the direction of travel.
+        """
+        if before is not None:
+            sql = "SELECT user_id, username, first_name, last_seen FROM users " \
+                  "WHERE user_id < ? AND last_seen >= ? ORDER BY user_id DESC LIMIT ?"
+            params = (str(before), since, limit + 1)
+        else:
+            sql = "SELECT user_id, username, first_name, last_seen FROM users " \
+                  "WHERE user_id > ? AND last_seen >= ? ORDER BY user_id LIMIT ?"
+            params = ("" if after is None else str(after), since, limit + 1)
+        users, _, _ = self._pending_view()
+        queued = [(user_id, username, first_name, last_seen)
+                  for user_id, username, first_name, _, last_seen in users.values()
+                  if last_seen >= since and _in_range(user_id, after, before)]
+        return self._page(sql, params, limit, before is not None, queued)
+
+    def page_groups(self, after=None, before=None, limit: int = 25, since: float = 0.0):
+        """Group chats with a member seen since `since`, ordered by chat_id, as
+        ([(chat_id, members, last_seen), ...], more); see page_users"""
+        # Group chat ids are negative, so as text they sort between "-" and "."
+        if before is not None:
+            sql = "SELECT chat_id, COUNT(*), MAX(last_seen) FROM user_chats WHERE chat_id > '-' AND chat_id < ? " \
+                  "GROUP BY chat_id HAVING MAX(last_seen) >= ? ORDER BY chat_id DESC LIMIT ?"
+            params = (str(before), since, limit + 1)
+        else:
+            sql = "SELECT chat_id, COUNT(*), MAX(last_seen) FROM user_chats WHERE chat_id > ? AND chat_id < '.' " \
+                  "GROUP BY chat_id HAVING MAX(last_seen) >= ? ORDER BY chat_id LIMIT ?"
+            params = ("-" if after is None else str(after), since, limit + 1)
+        queued = [group for group in self._queued_groups(since) if _in_range(group[0], after, before)]
+        return self._page(sql, params, limit, before is not None, queued)
+
+    def _queued_groups(self, since: float) -> list:
+        """(chat_id, members, last_seen) of groups with queued rows, as they will be once
+        flushed, for those active since `since`"""
+        _, chats, _ = self._pending_view()
+        by_chat = {}
+        for (user_id, chat_id), (_, _, last_seen) in chats.items():
+            if chat_id.startswith("-"):
+                by_chat.setdefault(chat_id, {})[user_id] = last_seen
+        groups = []
+        for chat_id, members in by_chat.items():
+            with self._read_lock:
+                count, last_seen = self._reader.execute(
+                    "SELECT COUNT(*), MAX(last_seen) FROM user_chats WHERE chat_id = ?", (chat_id,)).fetchone()
+            known = self._select_in("SELECT user_id FROM user_chats WHERE user_id IN ({}) AND chat_id = ?",
+                                    list(members), (chat_id,)) if count else set()
+            last_seen = max(last_seen or 0.0, max(members.values()))
+            if last_seen >= since:
+                groups.append((chat_id, count + len(members.keys() - known), last_seen))
+        return groups
+
+    def _page(self, sql: str, params: tuple, limit: int, backwards: bool, queued: list):
+        with self._read_lock:
+            rows = self._reader.execute(sql, params).fetchall()
+        if queued:
+            # Queued rows stand in for stored ones with the same key; a queued row is only
+            # ever newer, so every stored row on the page still qualifies
+            merged = {row[0]: row for row in rows}
+            merged.update((row[0], row) for row in queued)
+            rows = sorted(merged.values(), key=lambda row: row[0], reverse=backwards)[:limit + 1]
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+        return rows, more
+
+    def count_users(self, since: float = 0.0) -> int:
+        users, _, _ = self._pending_view()
+        active = [user_id for user_id, _, _, _, last_seen in users.values() if last_seen >= since]
+        with self._read_lock:
+            total = self._reader.execute("SELECT COUNT(*) FROM users WHERE last_seen >= ?", (since,)).fetchone()[0]
+        counted = self._select_in("SELECT user_id FROM users WHERE user_id IN ({}) AND last_seen >= ?", active, (since,))
+        return total + len(active) - len(counted)
+
+    def count_groups(self, since: float = 0.0) -> int:
+        active = [chat_id for chat_id, _, _ in self._queued_groups(since)]
+        with self._read_lock:
+            total = self._reader.execute(
+                "SELECT COUNT(*) FROM (SELECT chat_id FROM user_chats WHERE chat_id > '-' AND chat_id < '.' "
+                "GROUP BY chat_id HAVING MAX(last_seen) >= ?)", (since,)).fetchone()[0]
+        counted = self._select_in("SELECT chat_id FROM user_chats WHERE chat_id IN ({}) "
+                                  "GROUP BY chat_id HAVING MAX(last_seen) >= ?", active, (since,))
+        return total + len(active) - len(counted)
+
+    def private_chat_ids(self) -> list:
+        """Users who have talked to the bot in private, i.e. were seen in a chat with their own id"""
+        _, chats, forgets = self._pending_view()
+        with self._read_lock:
+            stored = {user_id for (user_id,) in self._reader.execute(
+                "SELECT user_id FROM user_chats WHERE chat_id = user_id")}
+        stored -= forgets
+        stored.update(user_id for user_id, chat_id in chats if user_id == chat_id)
+        return list(stored)
+
+    def _apply_pending(self) -> int:
+        with self._pending_lock:
+            users = dict(self._pending_users)
+            chats = dict(self._pending_chats)
+            forgets = dict(self._pending_forgets)
+        if not users and not chats and not forgets:
+            return 0
+        self._conn.executemany("DELETE FROM user_chats WHERE user_id = ? AND chat_id = ?", forgets.values())
+        self._conn.executemany(
+            "INSERT INTO users (user_id, username, first_name, first_seen, last_seen) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET username = excluded.username, "
+            "first_name = excluded.first_name, last_seen = excluded.last_seen", users.values())
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO user_chats (user_id, chat_id, last_seen) VALUES (?, ?, ?)", chats.values())
+        self._conn.commit()
+        # Committed: drop what was written, unless a newer row replaced it meanwhile
+        with self._pending_lock:
+            for pending, written in ((self._pending_users, users), (self._pending_chats, chats),
+                                     (self._pending_forgets, forgets)):
+                for key, row in written.items():
+                    if pending.get(key) is row:
+                        del pending[key]
+        return len(users) + len(chats) + len(forgets)
+
+    def flush(self) -> int:
+        with self._db_lock:
+            try:
+                return self._apply_pending()
+            except Exception as e:
+                self._conn.rollback()
+                logger.error(f"Error flushing user directory: {e}")
+                return 0
+
+    def close(self):
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+        with self._read_lock:
+            self._reader.close()
+
+    def get_stats(self) -> dict:
+        return {
+            "cached": len(self._users),
+            "pending": len(self._pending_users) + len(self._pending_chats) + len(self._pending_forgets),
+        }
+
+
+def _in_range(key: str, after=None, before=None) -> bool:
+    if before is not None:
+        return key < str(before)
+    return after is None or key > str(after)
+
+
+def user_label(username: str, first_name: str) -> str:
+    parts = []
+    if username:
+        parts.append(f"@{username}")
+    if first_name:
+        parts.append(f"({first_name[:32]})")
+    return " ".join(parts)
+
+
+def create_user_directory() -> UserDirectory:
+    """Stored in USER_DB_FILE (default: the history database file)"""
+    return UserDirectory(
+        os.environ.get("USER_DB_FILE", os.environ.get("HISTORY_DB_FILE", DEFAULT_HISTORY_DB_FILE)),
+        last_seen_resolution=float(os.environ.get("USER_LAST_SEEN_RESOLUTION", "300")),
+    )
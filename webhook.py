@@ -0,0 +1,57 @@
+import hmac
+import json
+import signal
+import asyncio
+import logging
+from telegram import Update
+from http_server import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+
+def make_webhook_handler(application, secret: str):
+    """POST handler feeding Telegram's webhook calls into the application's update queue"""
+    async def handle(request):
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, "").encode(), secret.encode()):
+            logger.warning("Rejected webhook call with a missing or wrong secret token")
+            return HttpResponse(403, "Forbidden")
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return HttpResponse(400, "Invalid JSON")
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        return HttpResponse(200, "ok")
+    return handle
+
+
+async def serve_webhook(application, server, url: str, secret: str, allowed_updates=None):
+    """Run the bot from webhook calls until SIGINT/SIGTERM, with the same lifecycle as
+    run_polling: initialize, post_init, start ... stop, post_shutdown, shutdown.
+    Without a url the webhook is left alone, for shard workers fed by a front."""
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stopping.set)
+        except NotImplementedError:
+            pass
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        if url:
+            await application.bot.set_webhook(url=url, secret_token=secret, allowed_updates=allowed_updates)
+            logger.info(f"Webhook set to {url}")
+        await stopping.wait()
+    finally:
+        await server.close()
+        if application.running:
+            await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()